@@ -0,0 +1,242 @@
+"""
+ALGORITHM REGISTRY + SHADOW RUNNER
+Several calculator versions side by side, compared in one pass over a case file.
+
+Every version has the same interface: a scalar callable (days, miles, receipts)
+and a vectorized score(days, miles, receipts) over arrays. Built in:
+- v9          the float engine with the built-in V9 rules
+- v9-fixed    the integer-cents engine with the same rules
+- active      the rules selected by REIMBURSEMENT_RULES (only when they differ from V9)
+- rules/<x>   every rules/*.json file, through the float engine
+- models/<x>  every models/*.json residual model on top of the rules it was trained for
+
+Earlier versions (V8 and before) predate this repository's history; they can
+be added with register() or by dropping their rule table into rules/.
+
+The shadow runner loads the cases once, scores them with the primary and every
+candidate, and reports each version's eval.sh metrics, how many claims each
+pair of versions disagrees on (by a cent or more) and the claims where each
+candidate diverges most from the primary.
+
+Usage:
+    python3 algorithm_registry.py --list
+    python3 algorithm_registry.py [cases.json] [--primary v9] [--candidates v9-fixed,rules/fitted] [--top 10] [--json]
+"""
+
+import glob
+import os
+import sys
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement, calculate_reimbursement_batch
+import case_store
+import reimbursement_rules as _rules
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class AlgorithmVersion:
+    """One registered calculator: a scalar entry point plus a vectorized one"""
+
+    def __init__(self, name, calculator, batch=None, description=''):
+        self.name = name
+        self.calculator = calculator
+        self.batch = batch
+        self.description = description
+
+    def __call__(self, trip_duration_days, miles_traveled, total_receipts_amount):
+        return self.calculator(trip_duration_days, miles_traveled, total_receipts_amount)
+
+    def score(self, trip_duration_days, miles_traveled, total_receipts_amount):
+        """Results for arrays of claims as a float64 array"""
+        if self.batch is not None:
+            return np.asarray(self.batch(trip_duration_days, miles_traveled, total_receipts_amount),
+                              dtype=np.float64)
+        return np.array([self.calculator(days, miles, receipts) for days, miles, receipts in
+                         zip(np.asarray(trip_duration_days).tolist(), np.asarray(miles_traveled).tolist(),
+                             np.asarray(total_receipts_amount).tolist())], dtype=np.float64)
+
+
+_registry = {}
+_builtins_loaded = False
+
+
+def register(name, calculator, batch=None, description=''):
+    """Add (or replace) a version; returns it"""
+    version = _registry[name] = AlgorithmVersion(name, calculator, batch, description)
+    return version
+
+
+def register_rules(name, rules, description=''):
+    """Register a rule set evaluated by the float engine"""
+    rules = _rules.compile_rules(rules)
+    return register(
+        name,
+        lambda days, miles, receipts: calculate_reimbursement(days, miles, receipts, rules=rules),
+        lambda days, miles, receipts: calculate_reimbursement_batch(days, miles, receipts, rules=rules),
+        description or f"float engine, rules {rules.version} ({_rules.rules_fingerprint(rules)})")
+
+
+def register_residual(name, model_path, rules=None, description=''):
+    """Register the rules plus a residual model artifact (see residual_model.py)"""
+    from residual_model import ResidualCalculator, ResidualModel
+
+    model = ResidualModel.load(model_path)
+    if rules is None:
+        # Artifacts name the rules they correct; V9 and the active rules are the ones we can match
+        rules = next((candidate for candidate in (_rules.DEFAULT_RULES, _rules.ACTIVE_RULES)
+                      if _rules.rules_fingerprint(candidate) == model.rules_fingerprint), _rules.DEFAULT_RULES)
+    calculator = ResidualCalculator(model, rules)
+    return register(name, calculator, calculator.batch,
+                    description or f"rules {calculator.rules.version} + residual model {os.path.basename(model_path)}")
+
+
+def _register_builtins():
+    import fixed_point
+
+    register_rules('v9', _rules.DEFAULT_RULES, "float engine, built-in V9 rules")
+    register('v9-fixed',
+             lambda days, miles, receipts: fixed_point.calculate_reimbursement_fixed(days, miles, receipts,
+                                                                                     _rules.DEFAULT_RULES),
+             lambda days, miles, receipts: fixed_point.calculate_reimbursement_fixed_batch(
+                 days, miles, receipts, _rules.DEFAULT_RULES),
+             "integer-cents engine, built-in V9 rules")
+    if _rules.rules_fingerprint(_rules.ACTIVE_RULES) != _rules.rules_fingerprint(_rules.DEFAULT_RULES):
+        register_rules('active', _rules.ACTIVE_RULES, "float engine, rules from REIMBURSEMENT_RULES")
+    for path in sorted(glob.glob(os.path.join(HERE, 'rules', '*.json'))):
+        try:
+            register_rules(f"rules/{os.path.splitext(os.path.basename(path))[0]}", _rules.load_rules(path))
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Skipping {path}: {error}", file=sys.stderr)
+    for path in sorted(glob.glob(os.path.join(HERE, 'models', '*.json'))):
+        try:
+            register_residual(f"models/{os.path.splitext(os.path.basename(path))[0]}", path)
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Skipping {path}: {error}", file=sys.stderr)
+
+
+def _ensure_builtins():
+    """Register the built-in versions once; explicit register() calls keep precedence by name"""
+    global _builtins_loaded
+    if _builtins_loaded:
+        return
+    _builtins_loaded = True
+    registered = dict(_registry)
+    _register_builtins()
+    _registry.update(registered)
+
+
+def get(name):
+    _ensure_builtins()
+    try:
+        return _registry[name]
+    except KeyError:
+        raise KeyError(f"unknown algorithm version {name!r}; known: {', '.join(sorted(_registry))}") from None
+
+
+def versions():
+    _ensure_builtins()
+    return dict(_registry)
+
+
+def shadow_run(cases_path, primary='v9', candidates=(), top=10):
+    """
+    Score cases_path with primary and candidates in one pass; returns a report dict with
+    per-version summaries (public files), pairwise disagreement counts and the
+    largest divergences of each candidate from the primary.
+    """
+    import evaluate
+
+    names = [primary] + [name for name in candidates if name != primary]
+    store = case_store.load_cases(cases_path)
+    days, miles, receipts = np.asarray(store.days), np.asarray(store.miles), np.asarray(store.receipts)
+    results = {name: get(name).score(days, miles, receipts) for name in names}
+
+    report = {'cases': len(store), 'primary': primary, 'versions': {}, 'disagreements': [], 'divergences': {}}
+    rows = list(store.rows()) if store.has_expected else None
+    for name in names:
+        entry = {'description': get(name).description}
+        if rows is not None:
+            summary = evaluate.summarize(rows, results[name].tolist(), top=0)
+            entry.update({key: summary[key] for key in ('score', 'exact_matches', 'close_matches',
+                                                        'average_error', 'max_error')})
+        report['versions'][name] = entry
+
+    for i, first in enumerate(names):
+        for second in names[i + 1:]:
+            differ = np.abs(results[first] - results[second]) >= 0.01 - 1e-9
+            report['disagreements'].append({'versions': [first, second], 'claims': int(differ.sum())})
+
+    for name in names[1:]:
+        delta = results[name] - results[primary]
+        worst = np.argsort(-np.abs(delta), kind='stable')[:top]
+        report['divergences'][name] = [
+            {'case': int(i) + 1, 'trip_duration_days': days[i].item(), 'miles_traveled': miles[i].item(),
+             'total_receipts_amount': receipts[i].item(), primary: results[primary][i].item(),
+             name: results[name][i].item(), 'delta': round(float(delta[i]), 2),
+             **({'expected': store.expected[i].item()} if store.has_expected else {})}
+            for i in worst if abs(delta[i]) >= 0.01 - 1e-9
+        ]
+    return report
+
+
+def print_report(report):
+    print(f"Shadow run over {report['cases']} cases, primary {report['primary']}")
+    print("\nVERSIONS")
+    for name, entry in report['versions'].items():
+        line = f"  {name:<16} {entry['description']}"
+        if 'score' in entry:
+            line += (f"\n{'':<19}score {entry['score']:.2f}, exact {entry['exact_matches']}, "
+                     f"close {entry['close_matches']}, avg error ${entry['average_error']:.2f}")
+        print(line)
+    print("\nDISAGREEMENTS (claims differing by a cent or more)")
+    for pair in report['disagreements']:
+        print(f"  {pair['versions'][0]} vs {pair['versions'][1]}: {pair['claims']}")
+    for name, cases in report['divergences'].items():
+        print(f"\nLARGEST DIVERGENCES {name} vs {report['primary']}")
+        if not cases:
+            print("  none")
+        for case in cases:
+            expected = f", expected ${case['expected']:.2f}" if 'expected' in case else ''
+            print(f"  Case {case['case']}: {case['trip_duration_days']:g} days, {case['miles_traveled']:g} miles, "
+                  f"${case['total_receipts_amount']:.2f} receipts: ${case[report['primary']]:.2f} -> "
+                  f"${case[name]:.2f} ({case['delta']:+.2f}){expected}")
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare calculator versions over a case file in one pass")
+    parser.add_argument('cases', nargs='?', default='public_cases.json')
+    parser.add_argument('--list', action='store_true', help="list registered versions and exit")
+    parser.add_argument('--primary', default='v9')
+    parser.add_argument('--candidates', help="comma-separated versions (default: every other registered version)")
+    parser.add_argument('--top', type=int, default=10, help="largest divergences to list per candidate")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, version in versions().items():
+            print(f"{name:<16} {version.description}")
+        return
+
+    if args.candidates:
+        candidates = [name.strip() for name in args.candidates.split(',') if name.strip()]
+    else:
+        candidates = [name for name in versions() if name != args.primary]
+    try:
+        report = shadow_run(args.cases, args.primary, candidates, args.top)
+    except KeyError as error:
+        parser.error(error.args[0])
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
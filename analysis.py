@@ -0,0 +1,192 @@
+"""
+ANALYSIS TOOLKIT
+One DataFrame of cases, predictions and residuals, plus reusable queries.
+
+The analyze_* scripts used to reload the JSON and rebuild the same derived
+fields (efficiency, base estimate, receipt ratio, mileage buckets) in Python
+loops. load_frame() does it once, vectorized, and the query functions below
+answer the recurring questions in one call each:
+
+    frame = load_frame()
+    residuals_by_days(frame)
+    residuals_by_receipt_tier(frame)
+    residuals_by_efficiency(frame)
+    monotonicity_violations(frame)
+    worst_cases(frame, 10)
+    explain_cases('private_cases.json')  # per-claim component attribution
+
+From the shell: python3 analysis.py [days|tiers|efficiency|monotonicity|worst|penalties]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from calculate_reimbursement import calculate_reimbursement_batch, explain_reimbursement_batch
+import case_store
+import reimbursement_rules as _rules
+
+MILEAGE_RATE = 0.58
+# Upper bounds (exclusive) of the efficiency buckets used throughout the analysis scripts
+EFFICIENCY_BUCKETS = ((30, 'very_low'), (60, 'low'), (100, 'medium'), (np.inf, 'high'))
+
+
+def load_frame(path='public_cases.json', rules=None, base_per_day=75):
+    """
+    Cases from path with model predictions and derived fields, in file order.
+
+    Columns: days, miles, receipts, expected (public files only), predicted,
+    residual (predicted - expected), abs_error, efficiency, base_estimate
+    (days * base_per_day + miles * 0.58), receipt_effect, receipt_ratio,
+    receipt_tier, efficiency_bucket, mile_bucket. The index is the 1-based case number.
+    """
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    store = case_store.load_cases(path)
+    frame = pd.DataFrame({
+        'days': np.asarray(store.days),
+        'miles': np.asarray(store.miles),
+        'receipts': np.asarray(store.receipts),
+    }, index=pd.RangeIndex(1, len(store) + 1, name='case'))
+
+    frame['predicted'] = calculate_reimbursement_batch(frame['days'], frame['miles'], frame['receipts'],
+                                                       rules=rules)
+    days = frame['days'].to_numpy()
+    frame['efficiency'] = np.divide(frame['miles'].to_numpy(), days, out=np.zeros(len(frame)),
+                                    where=days > 0)
+    frame['base_estimate'] = frame['days'] * base_per_day + frame['miles'] * MILEAGE_RATE
+
+    if store.has_expected:
+        frame['expected'] = np.asarray(store.expected)
+        frame['residual'] = frame['predicted'] - frame['expected']
+        frame['abs_error'] = frame['residual'].abs()
+        frame['receipt_effect'] = frame['expected'] - frame['base_estimate']
+        frame['receipt_ratio'] = np.divide(frame['receipt_effect'].to_numpy(), frame['receipts'].to_numpy(),
+                                           out=np.zeros(len(frame)), where=frame['receipts'].to_numpy() > 0)
+
+    tier_index = np.searchsorted(np.asarray(rules.normal_bounds, dtype=np.float64), frame['receipts'],
+                                 side='right')
+    frame['receipt_tier'] = pd.Categorical.from_codes(tier_index, _rules.tier_labels(rules.normal_bounds))
+    bucket_bounds = np.array([bound for bound, _ in EFFICIENCY_BUCKETS])
+    frame['efficiency_bucket'] = pd.Categorical.from_codes(
+        np.searchsorted(bucket_bounds, frame['efficiency'], side='right'),
+        [label for _, label in EFFICIENCY_BUCKETS])
+    # round-half-even, like Python's round() in the original similar-trip grouping
+    frame['mile_bucket'] = (np.round(frame['miles'] / 50) * 50).astype(np.int64)
+    return frame
+
+
+def explain_cases(path='private_cases.json', rules=None):
+    """
+    Explanation table for a whole claim file: one row per case with every
+    component amount, the receipt tier, the penalty pattern and the floor flag.
+    """
+    store = case_store.load_cases(path)
+    table = pd.DataFrame(explain_reimbursement_batch(store.days, store.miles, store.receipts, rules=rules),
+                         index=pd.RangeIndex(1, len(store) + 1, name='case'))
+    table['trip_duration_days'] = table['trip_duration_days'].astype(np.int64)
+    return table
+
+
+def receipt_contribution(frame, base_per_day):
+    """expected - (days * base_per_day + miles * 0.58); base_per_day may be a scalar or per-case Series"""
+    return frame['expected'] - (frame['days'] * base_per_day + frame['miles'] * MILEAGE_RATE)
+
+
+def residuals_by(frame, by, value='residual'):
+    """count / mean / mean-absolute / max-absolute of value per group"""
+    grouped = frame.groupby(by, observed=True)[value]
+    return pd.DataFrame({
+        'count': grouped.size(),
+        'mean': grouped.mean(),
+        'mean_abs': grouped.apply(lambda values: values.abs().mean()),
+        'max_abs': grouped.apply(lambda values: values.abs().max()),
+    })
+
+
+def residuals_by_days(frame):
+    return residuals_by(frame, 'days')
+
+
+def residuals_by_receipt_tier(frame):
+    return residuals_by(frame, 'receipt_tier')
+
+
+def residuals_by_efficiency(frame):
+    return residuals_by(frame, 'efficiency_bucket')
+
+
+def worst_cases(frame, n=10):
+    """The n cases with the largest absolute error, worst first"""
+    return frame.sort_values('abs_error', ascending=False, kind='stable').head(n)
+
+
+def high_receipt_penalties(frame, min_receipts=1500):
+    """High-receipt cases whose expected output is below the base estimate, biggest penalty first"""
+    selected = frame[(frame['receipts'] > min_receipts) & (frame['expected'] < frame['base_estimate'])]
+    selected = selected.assign(penalty=selected['base_estimate'] - selected['expected'])
+    return selected.sort_values('penalty', ascending=False, kind='stable')
+
+
+def monotonicity_violations(frame, receipt_factor=1.5, min_group=3, by=('days', 'mile_bucket'),
+                            value='expected'):
+    """
+    Neighbouring trips where clearly higher receipts led to a lower value.
+
+    Cases are grouped by `by` (same day count and 50-mile bucket by default);
+    groups with at least min_group cases are sorted by receipts and each
+    consecutive pair is flagged when the higher receipts exceed the lower by
+    receipt_factor but value went down. Groups appear in order of first
+    occurrence, pairs in receipt order.
+    """
+    by = list(by)
+    sizes = frame.groupby(by, sort=False)['receipts'].transform('size')
+    candidates = frame[sizes >= min_group].copy()
+    group_order = candidates.groupby(by, sort=False).ngroup()
+    candidates = candidates.assign(_group=group_order.to_numpy(), _case=candidates.index)
+    candidates = candidates.sort_values(['_group', 'receipts'], kind='stable')
+
+    following = candidates.groupby('_group', sort=False)[['receipts', value, '_case']].shift(-1)
+    violation = ((following['receipts'] > candidates['receipts'] * receipt_factor) &
+                 (following[value] < candidates[value]))
+    low = candidates[violation]
+    high = following[violation]
+    result = pd.DataFrame({**{key: low[key].to_numpy() for key in by},
+                           'low_case': low['_case'].to_numpy(),
+                           'low_receipts': low['receipts'].to_numpy(),
+                           f'low_{value}': low[value].to_numpy(),
+                           'high_case': high['_case'].astype(np.int64).to_numpy(),
+                           'high_receipts': high['receipts'].to_numpy(),
+                           f'high_{value}': high[value].to_numpy()})
+    result['drop'] = result[f'low_{value}'] - result[f'high_{value}']
+    return result
+
+
+REPORTS = {
+    'days': residuals_by_days,
+    'tiers': residuals_by_receipt_tier,
+    'efficiency': residuals_by_efficiency,
+    'monotonicity': monotonicity_violations,
+    'worst': worst_cases,
+    'penalties': high_receipt_penalties,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    names = argv or ['days', 'tiers', 'efficiency', 'worst']
+    unknown = [name for name in names if name not in REPORTS]
+    if unknown:
+        print(f"Unknown report(s): {', '.join(unknown)}. Choose from: {', '.join(REPORTS)}", file=sys.stderr)
+        sys.exit(1)
+
+    frame = load_frame()
+    with pd.option_context('display.width', 160, 'display.max_columns', 20):
+        for name in names:
+            print(f"\n{name.upper()}")
+            print("=" * 40)
+            print(REPORTS[name](frame))
+
+
+if __name__ == "__main__":
+    main()
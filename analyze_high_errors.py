@@ -1,8 +1,7 @@
-import json
+from analysis import high_receipt_penalties, load_frame
 
-# Load test cases
-with open('public_cases.json', 'r') as f:
-    cases = json.load(f)
+# Load test cases with derived fields (base estimate = days * 75 + miles * 0.58)
+frame = load_frame('public_cases.json')
 
 # Analyze the specific high-error cases
 high_error_cases = [
@@ -37,70 +36,21 @@ for days, miles, receipts, expected in high_error_cases:
 print("HIGH RECEIPTS WITH LOW OUTPUTS:")
 print("-" * 40)
 
-low_output_high_receipt = []
-for case in cases:
-    receipts = case['input']['total_receipts_amount']
-    output = case['expected_output']
-    days = case['input']['trip_duration_days']
-    miles = case['input']['miles_traveled']
-    
-    if receipts > 1500:  # High receipts
-        base_estimate = days * 75 + miles * 0.58
-        if output < base_estimate:  # Output is lower than base estimate
-            low_output_high_receipt.append({
-                'days': days,
-                'miles': miles,
-                'receipts': receipts,
-                'output': output,
-                'base_est': base_estimate,
-                'penalty': base_estimate - output
-            })
-
-# Sort by penalty (highest penalty first)
-low_output_high_receipt.sort(key=lambda x: x['penalty'], reverse=True)
+low_output_high_receipt = high_receipt_penalties(frame, min_receipts=1500)
 
 print("TOP 10 HIGH-RECEIPT PENALTY CASES:")
-for i, case in enumerate(low_output_high_receipt[:10]):
-    efficiency = case['miles'] / case['days'] if case['days'] > 0 else 0
-    print(f"{i+1}. {case['days']}d, {case['miles']}mi ({efficiency:.1f} mi/day), ${case['receipts']:.2f}")
-    print(f"   Expected: ${case['output']:.2f}, Base est: ${case['base_est']:.2f}")
-    print(f"   Penalty: ${case['penalty']:.2f}")
+for i, case in enumerate(low_output_high_receipt.head(10).itertuples()):
+    print(f"{i+1}. {case.days}d, {case.miles:g}mi ({case.efficiency:.1f} mi/day), ${case.receipts:.2f}")
+    print(f"   Expected: ${case.expected:.2f}, Base est: ${case.base_estimate:.2f}")
+    print(f"   Penalty: ${case.penalty:.2f}")
 
 # Look for patterns in efficiency vs receipts
 print(f"\nEFFICIENCY VS RECEIPT PATTERNS:")
 print("-" * 30)
 
-efficiency_buckets = {
-    'very_low': [],    # < 30 mi/day
-    'low': [],         # 30-60 mi/day  
-    'medium': [],      # 60-100 mi/day
-    'high': [],        # 100+ mi/day
-}
-
-for case in cases:
-    days = case['input']['trip_duration_days']
-    miles = case['input']['miles_traveled']
-    receipts = case['input']['total_receipts_amount']
-    output = case['expected_output']
-    
-    if days > 0 and receipts > 1000:  # Focus on high-receipt cases
-        efficiency = miles / days
-        base_estimate = days * 75 + miles * 0.58
-        receipt_effect = output - base_estimate
-        receipt_ratio = receipt_effect / receipts
-        
-        if efficiency < 30:
-            bucket = 'very_low'
-        elif efficiency < 60:
-            bucket = 'low'
-        elif efficiency < 100:
-            bucket = 'medium'
-        else:
-            bucket = 'high'
-            
-        efficiency_buckets[bucket].append(receipt_ratio)
+# Buckets: very_low < 30, low 30-60, medium 60-100, high 100+ mi/day
+high_receipt = frame[(frame['days'] > 0) & (frame['receipts'] > 1000)]  # Focus on high-receipt cases
+ratios_by_bucket = high_receipt.groupby('efficiency_bucket', observed=True)['receipt_ratio'].agg(['count', 'mean'])
 
-for bucket, ratios in efficiency_buckets.items():
-    if ratios:
-        avg_ratio = sum(ratios) / len(ratios)
-        print(f"{bucket.upper()} efficiency: {len(ratios)} cases, avg receipt ratio: {avg_ratio:.3f}") 
\ No newline at end of file
+for bucket, row in ratios_by_bucket.iterrows():
+    print(f"{bucket.upper()} efficiency: {row['count']:.0f} cases, avg receipt ratio: {row['mean']:.3f}")
@@ -1,8 +1,7 @@
-import json
+import analysis
 
-# Load test cases
-with open('public_cases.json', 'r') as f:
-    cases = json.load(f)
+# Load test cases with derived fields
+frame = analysis.load_frame('public_cases.json')
 
 # Analyze high-error cases specifically
 high_error_patterns = [
@@ -36,30 +35,19 @@ for days, miles, receipts, expected in high_error_patterns:
 print("LOW-RECEIPT CASES BY TRIP LENGTH:")
 print("=" * 40)
 
-by_days = {}
-for case in cases:
-    receipts = case['input']['total_receipts_amount']
-    if receipts < 30:  # Focus on low-receipt cases
-        days = case['input']['trip_duration_days']
-        if days not in by_days:
-            by_days[days] = []
-        by_days[days].append({
-            'miles': case['input']['miles_traveled'],
-            'receipts': receipts,
-            'output': case['expected_output']
-        })
+low_receipt = frame[frame['receipts'] < 30]  # Focus on low-receipt cases
+by_days = low_receipt.groupby('days')[['expected', 'miles', 'receipts']].agg(['count', 'mean'])
+
+for days, row in by_days.head(10).iterrows():  # First 10 day lengths
+    if row[('expected', 'count')] >= 3:
+        avg_output = row[('expected', 'mean')]
+        avg_miles = row[('miles', 'mean')]
 
-for days in sorted(by_days.keys())[:10]:  # First 10 day lengths
-    if len(by_days[days]) >= 3:
-        avg_output = sum(c['output'] for c in by_days[days]) / len(by_days[days])
-        avg_miles = sum(c['miles'] for c in by_days[days]) / len(by_days[days])
-        avg_receipts = sum(c['receipts'] for c in by_days[days]) / len(by_days[days])
-        
         # Remove mileage component to see base rate
         avg_mileage_component = avg_miles * 0.58
         avg_base = avg_output - avg_mileage_component
         base_per_day = avg_base / days
-        
+
         print(f"{days}-day trips (low receipts): avg total=${avg_output:.2f}")
         print(f"  After mileage: ${avg_base:.2f}, per day: ${base_per_day:.2f}")
 
@@ -72,25 +60,12 @@ receipt_ranges = [
     (300, 1000), (1000, 2000), (2000, 5000)
 ]
 
+# Estimate what the output should be without receipts (rough estimate: $100/day)
+contribution = analysis.receipt_contribution(frame, 100)
+frame['scaling_ratio'] = (contribution / frame['receipts']).where(frame['receipts'] > 0, 0)
+
 for min_r, max_r in receipt_ranges:
-    matching_cases = []
-    for case in cases:
-        receipts = case['input']['total_receipts_amount']
-        if min_r <= receipts < max_r:
-            days = case['input']['trip_duration_days']
-            miles = case['input']['miles_traveled']
-            output = case['expected_output']
-            
-            # Estimate what the output should be without receipts
-            base_estimate = days * 100 + miles * 0.58  # Rough estimate
-            receipt_contribution = output - base_estimate
-            
-            matching_cases.append({
-                'receipts': receipts,
-                'contribution': receipt_contribution,
-                'ratio': receipt_contribution / receipts if receipts > 0 else 0
-            })
-    
-    if matching_cases:
-        avg_ratio = sum(c['ratio'] for c in matching_cases) / len(matching_cases)
-        print(f"Receipts ${min_r}-${max_r}: {len(matching_cases)} cases, avg ratio: {avg_ratio:.3f}") 
\ No newline at end of file
+    matching_cases = frame[(frame['receipts'] >= min_r) & (frame['receipts'] < max_r)]
+    if len(matching_cases):
+        avg_ratio = matching_cases['scaling_ratio'].mean()
+        print(f"Receipts ${min_r}-${max_r}: {len(matching_cases)} cases, avg ratio: {avg_ratio:.3f}")
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+BENCHMARK SUITE
+Measures how fast the calculator is, so slowdowns are caught before they ship.
+
+Three kinds of measurement (all times in seconds, lower is better):
+- micro.<regime>      per-call cost of calculate_reimbursement in each receipt /
+                      day-count regime (tiers, penalty patterns, bonuses, floor)
+- cold_start.<path>   wall time of one CLI invocation (run.sh with no server,
+                      calculate_reimbursement.py directly, the minimal reimbursement_cli
+                      and its zipapp, and a bare `python3 -S` as the floor)
+- e2e.<file>.<path>   time to score a whole case file through each path:
+                      scalar, batch, server (stdio protocol) and parallel
+
+Results are written as JSON together with environment metadata. With
+--compare, every metric is checked against a saved baseline and the run fails
+when one got slower by more than --threshold. --startup-budget runs only the
+cold-start measurements and fails when reimbursement_cli costs more than the
+budget on top of the bare interpreter.
+
+Usage:
+    python3 benchmarks.py [-o bench.json] [--quick] [--compare baseline.json] [--threshold 0.2]
+    python3 benchmarks.py --startup-budget 0.005
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement, calculate_reimbursement_batch
+import case_store
+import evaluate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# One representative claim per branch family of the V9 rules
+MICRO_REGIMES = {
+    'receipts_under_10': (3, 93, 1.42),
+    'receipts_under_100': (1, 55, 45.10),
+    'receipts_under_500': (2, 130, 320.50),
+    'receipts_under_1000': (4, 300, 750.25),
+    'receipts_under_2000': (6, 600, 1500.00),
+    'receipts_over_2000': (7, 800, 2400.00),
+    'penalty_pattern': (5, 516, 1878.49),
+    'five_day_bonus': (5, 250, 150.75),
+    'long_trip_14_plus': (14, 481, 939.99),
+    'minimum_floor': (1, 0, 0),
+}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'git_commit': commit,
+    }
+
+
+def bench_micro(quick=False):
+    """Best-of-repeats seconds per calculate_reimbursement call, per regime"""
+    number = 2000 if quick else 20000
+    results = {}
+    for name, args in MICRO_REGIMES.items():
+        timings = timeit.repeat(lambda: calculate_reimbursement(*args), number=number, repeat=5)
+        results[f'micro.{name}'] = min(timings) / number
+    return results
+
+
+def _cold_start_timings(runs):
+    """Seconds per run of each CLI process, run round-robin so load drifts hit every command alike"""
+    import tempfile
+
+    import reimbursement_cli
+
+    env = dict(os.environ, REIMBURSEMENT_SERVER_PORT_FILE=os.devnull)
+    env.pop('REIMBURSEMENT_SERVER_PORT', None)
+    claim = ['5', '250', '150.75']
+    with tempfile.TemporaryDirectory() as tmp:
+        zipapp = os.path.join(tmp, 'reimbursement.pyz')
+        reimbursement_cli.build_zipapp(zipapp)
+        commands = {
+            'interpreter': [sys.executable, '-S', '-c', 'pass'],
+            'run_sh': ['./run.sh'] + claim,
+            'python_cli': [sys.executable, 'calculate_reimbursement.py'] + claim,
+            'claim_cli': [sys.executable, '-S', '-c', 'import reimbursement_cli; reimbursement_cli.main()'] + claim,
+            'claim_cli_zipapp': [sys.executable, '-I', '-S', zipapp] + claim,
+        }
+        timings = {name: [] for name in commands}
+        for _ in range(runs):
+            for name, command in commands.items():
+                start = time.perf_counter()
+                subprocess.run(command, cwd=HERE, env=env, check=True, stdout=subprocess.DEVNULL)
+                timings[name].append(time.perf_counter() - start)
+    return timings
+
+
+def bench_cold_start(quick=False, timings=None):
+    """Median seconds for one CLI process, with no server to hand off to"""
+    timings = timings or _cold_start_timings(5 if quick else 20)
+    return {f'cold_start.{name}': statistics.median(values) for name, values in timings.items()}
+
+
+def startup_overhead(timings):
+    """Median seconds reimbursement_cli adds to a bare `python3 -S` start, paired run by run"""
+    return statistics.median(cli - bare for cli, bare in zip(timings['claim_cli'], timings['interpreter']))
+
+
+def _time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _score_through_server(rows):
+    """Score rows through a warm `--serve --stdio` co-process; start-up is not timed"""
+    server = subprocess.Popen([sys.executable, 'calculate_reimbursement.py', '--serve', '--stdio'],
+                              cwd=HERE, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdin.write('5\t250\t150.75\n')
+        server.stdin.flush()
+        server.stdout.readline()
+
+        def feed():
+            server.stdin.writelines(f"{days}\t{miles}\t{receipts}\n" for days, miles, receipts, *_ in rows)
+            server.stdin.flush()
+
+        start = time.perf_counter()
+        writer = threading.Thread(target=feed)
+        writer.start()
+        for _ in rows:
+            server.stdout.readline()
+        writer.join()
+        return time.perf_counter() - start
+    finally:
+        server.stdin.close()
+        server.wait()
+
+
+def bench_end_to_end(quick=False):
+    """Seconds to score every case of each case file through each available path"""
+    repeat = 1 if quick else 3
+    workers = os.cpu_count() or 1
+    results = {}
+    for path in ('public_cases.json', 'private_cases.json'):
+        store = case_store.load_cases(os.path.join(HERE, path))
+        rows = list(store.rows())
+        label = f"e2e.{os.path.splitext(path)[0]}"
+
+        results[f'{label}.scalar'] = _time(
+            lambda: [calculate_reimbursement(days, miles, receipts) for days, miles, receipts, *_ in rows],
+            repeat)
+        results[f'{label}.batch'] = _time(
+            lambda: calculate_reimbursement_batch(store.days, store.miles, store.receipts), repeat)
+        results[f'{label}.server'] = min(_score_through_server(rows) for _ in range(repeat))
+        results[f'{label}.parallel'] = _time(lambda: evaluate.compute_results(rows, workers), repeat)
+    return results
+
+
+def run_benchmarks(quick=False):
+    results = {}
+    results.update(bench_micro(quick))
+    results.update(bench_cold_start(quick))
+    results.update(bench_end_to_end(quick))
+    return {'environment': _environment(), 'results': results}
+
+
+def compare(current, baseline, threshold=0.2):
+    """List of (metric, baseline, current, ratio) for metrics slower than baseline * (1 + threshold)"""
+    regressions = []
+    for name, base_value in baseline['results'].items():
+        value = current['results'].get(name)
+        if value is None or base_value <= 0:
+            continue
+        ratio = value / base_value
+        if ratio > 1 + threshold:
+            regressions.append((name, base_value, value, ratio))
+    return regressions
+
+
+def _format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:10.2f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:10.2f} ms"
+    return f"{seconds:10.2f} s "
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calculator benchmark suite")
+    parser.add_argument('-o', '--output', help="write results JSON here")
+    parser.add_argument('--quick', action='store_true', help="fewer repetitions")
+    parser.add_argument('--compare', metavar='BASELINE', help="flag regressions against a saved results JSON")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown before a metric counts as a regression (0.2 = 20%%)")
+    parser.add_argument('--startup-budget', type=float, metavar='SECONDS',
+                        help="only time cold starts; fail if reimbursement_cli adds more than this to the interpreter")
+    args = parser.parse_args(argv)
+
+    if args.startup_budget is not None:
+        timings = _cold_start_timings(10 if args.quick else 40)
+        for name, seconds in bench_cold_start(timings=timings).items():
+            print(f"  {name:<40} {_format_seconds(seconds)}")
+        overhead = startup_overhead(timings)
+        if overhead > args.startup_budget:
+            print(f"\n❌ reimbursement_cli start-up costs {_format_seconds(overhead).strip()} over the interpreter, "
+                  f"budget {_format_seconds(args.startup_budget).strip()}")
+            sys.exit(1)
+        print(f"\n✅ reimbursement_cli start-up costs {_format_seconds(overhead).strip()} over the interpreter "
+              f"(budget {_format_seconds(args.startup_budget).strip()})")
+        return
+
+    report = run_benchmarks(args.quick)
+    for name, seconds in report['results'].items():
+        print(f"  {name:<40} {_format_seconds(seconds)}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for name, base_value, value, ratio in regressions:
+                print(f"  {name}: {_format_seconds(base_value).strip()} -> "
+                      f"{_format_seconds(value).strip()} ({ratio:.2f}x)")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
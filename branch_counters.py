@@ -0,0 +1,314 @@
+"""
+BRANCH-HIT INSTRUMENTATION
+Counts how often each rule branch fires and how many dollars it moves.
+
+Branches (branch / label):
+- claims / all                      every scored claim; contribution = results paid
+- receipt_tier / <tier label>       e.g. "normal <500", "penalty <1000", or "none"; contribution = receipt component
+- pattern / <pattern name>          a problematic-pattern penalty; contribution = penalty vs the normal tier
+- five_day_bonus / normal|reduced   the 5-day $300 bonus or its $50 reduced form
+- long_trip_bonus / 10+, 14+        the long-trip bonuses
+- floor / minimum                   the max(50, ...) floor; contribution = amount it added
+
+Disabled (the default) the calculators pay one `is not None` check per call.
+Once enabled, the scalar path records each claim into a per-thread shard (no
+locking on the hot path) and the batch path records whole arrays with
+np.bincount. When a thread exits, its shard is folded into the merged totals,
+so a thread-per-connection server keeps one shard per live thread, not one
+per connection ever served. snapshot() sums the shards; snapshots from worker processes are
+combined with merge_snapshots() or BranchCounters.merge().
+
+    import branch_counters
+    counters = branch_counters.enable()
+    ...score claims...
+    print(branch_counters.to_prometheus(counters.snapshot()))
+
+From the shell, over a whole case file (optionally across processes):
+    python3 branch_counters.py [cases.json] [--workers N] [--batch] [--format json|prometheus]
+"""
+
+import json
+import sys
+import threading
+import weakref
+from bisect import bisect_right
+
+import calculate_reimbursement as _calculator
+
+
+class _ShardOwner:
+    """Lives in a thread's local storage; freed when the thread exits"""
+
+    __slots__ = ('__weakref__',)
+
+
+class BranchCounters:
+    """Per-thread hit counts and contribution totals, merged on snapshot()"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = {}  # id(shard) -> shard, live threads only
+        self._merged = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard).atexit = False
+        return shard
+
+    def _retire(self, shard):
+        """Fold an exited thread's shard into the merged totals"""
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            self._fold(shard)
+
+    def _fold(self, shard):
+        for key, (hits, contribution) in shard.items():
+            merged = self._merged.setdefault(key, [0, 0.0])
+            merged[0] += hits
+            merged[1] += contribution
+
+    def shard_count(self):
+        """Shards of threads still alive"""
+        with self._lock:
+            return len(self._shards)
+
+    def add(self, branch, label, hits=1, contribution=0.0):
+        shard = self._shard()
+        entry = shard.get((branch, label))
+        if entry is None:
+            entry = shard[(branch, label)] = [0, 0.0]
+        entry[0] += hits
+        entry[1] += contribution
+
+    def record(self, rules, trip_duration_days, total_receipts_amount, evaluation):
+        """Record one evaluate_claim() tuple from the scalar path"""
+        (_, _, _, _, pattern_index, receipt_tier, _, receipt_component, _,
+         total_before_floor, total) = evaluation
+        add = self.add
+        add('claims', 'all', 1, round(total, 2))
+
+        if receipt_tier is None:
+            add('receipt_tier', 'none')
+        elif pattern_index is None:
+            add('receipt_tier', rules.normal_tier_labels[receipt_tier], 1, receipt_component)
+        else:
+            add('receipt_tier', rules.penalty_tier_labels[receipt_tier], 1, receipt_component)
+
+        if pattern_index is not None:
+            penalty = 0.0
+            if total_receipts_amount > 0:
+                normal_rate = rules.normal_rates[bisect_right(rules.normal_bounds, total_receipts_amount)]
+                penalty = receipt_component - total_receipts_amount * normal_rate
+            add('pattern', rules.pattern_name(pattern_index), 1, penalty)
+
+        if trip_duration_days == 5:
+            if pattern_index is not None and rules.patterns[pattern_index][6]:
+                add('five_day_bonus', 'reduced', 1, rules.five_day_bonus_reduced)
+            else:
+                add('five_day_bonus', 'normal', 1, rules.five_day_bonus)
+        for min_days, bonus in rules.long_trip_bonuses:
+            if trip_duration_days >= min_days:
+                add('long_trip_bonus', f'{min_days}+', 1, bonus)
+
+        if total > total_before_floor:
+            add('floor', 'minimum', 1, total - total_before_floor)
+
+    def record_batch(self, columns):
+        """Record a whole _evaluate_batch() result with array operations"""
+        import numpy as np
+
+        rules = columns['rules']
+        days = columns['trip_duration_days']
+        receipts = columns['total_receipts_amount']
+        pattern_index = columns['pattern_index'].ravel()
+        tier_index = columns['receipt_tier_index'].ravel()
+        receipt_component = columns['receipt_component'].ravel()
+        add = self.add
+        add('claims', 'all', int(days.size), float(columns['result'].sum()))
+
+        labels = list(rules.normal_tier_labels) + list(rules.penalty_tier_labels)
+        has_tier = tier_index >= 0
+        hits = np.bincount(tier_index[has_tier], minlength=len(labels))
+        amounts = np.bincount(tier_index[has_tier], weights=receipt_component[has_tier], minlength=len(labels))
+        for label, count, amount in zip(labels, hits.tolist(), amounts.tolist()):
+            if count:
+                add('receipt_tier', label, count, amount)
+        no_receipts = int(np.count_nonzero(~has_tier))
+        if no_receipts:
+            add('receipt_tier', 'none', no_receipts)
+
+        matched = pattern_index >= 0
+        if matched.any():
+            flat_receipts = receipts.ravel()
+            normal_rates = np.asarray(rules.normal_rates, dtype=np.float64)
+            normal_tier = np.searchsorted(np.asarray(rules.normal_bounds, dtype=np.float64), flat_receipts,
+                                          side='right')
+            penalty = np.where(flat_receipts > 0, receipt_component - flat_receipts * normal_rates[normal_tier], 0.0)
+            hits = np.bincount(pattern_index[matched], minlength=len(rules.patterns))
+            amounts = np.bincount(pattern_index[matched], weights=penalty[matched], minlength=len(rules.patterns))
+            for index, (count, amount) in enumerate(zip(hits.tolist(), amounts.tolist())):
+                if count:
+                    add('pattern', rules.pattern_name(index), count, amount)
+
+        flat_days = days.ravel()
+        five_day = flat_days == 5
+        if five_day.any():
+            reduces = np.array([pattern[6] for pattern in rules.patterns] + [False])
+            reduced = int(np.count_nonzero(five_day & reduces[pattern_index]))
+            normal = int(np.count_nonzero(five_day)) - reduced
+            if normal:
+                add('five_day_bonus', 'normal', normal, normal * rules.five_day_bonus)
+            if reduced:
+                add('five_day_bonus', 'reduced', reduced, reduced * rules.five_day_bonus_reduced)
+        for min_days, bonus in rules.long_trip_bonuses:
+            count = int(np.count_nonzero(flat_days >= min_days))
+            if count:
+                add('long_trip_bonus', f'{min_days}+', count, count * bonus)
+
+        floored = columns['floor_applied'].ravel()
+        count = int(np.count_nonzero(floored))
+        if count:
+            lifted = float((rules.minimum - columns['total_before_floor'].ravel()[floored]).sum())
+            add('floor', 'minimum', count, lifted)
+
+    def merge(self, snapshot):
+        """Fold in a snapshot from another process"""
+        with self._lock:
+            for branch, labels in snapshot.items():
+                for label, entry in labels.items():
+                    merged = self._merged.setdefault((branch, label), [0, 0.0])
+                    merged[0] += entry['hits']
+                    merged[1] += entry['contribution']
+
+    def snapshot(self):
+        """{branch: {label: {'hits': n, 'contribution': dollars}}} summed over every thread"""
+        with self._lock:
+            shards = [dict(shard) for shard in self._shards.values()] + [dict(self._merged)]
+        totals = {}
+        for shard in shards:
+            for key, (hits, contribution) in shard.items():
+                total = totals.setdefault(key, [0, 0.0])
+                total[0] += hits
+                total[1] += contribution
+        result = {}
+        for (branch, label), (hits, contribution) in sorted(totals.items()):
+            result.setdefault(branch, {})[label] = {'hits': hits, 'contribution': contribution}
+        return result
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.clear()
+            self._merged.clear()
+
+
+def merge_snapshots(*snapshots):
+    """Sum snapshots (e.g. one per worker process) into one"""
+    counters = BranchCounters()
+    for snapshot in snapshots:
+        counters.merge(snapshot)
+    return counters.snapshot()
+
+
+def enable(counters=None):
+    """Start recording in this process; returns the active BranchCounters"""
+    if counters is None:
+        counters = _calculator._branch_counters or BranchCounters()
+    _calculator._branch_counters = counters
+    return counters
+
+
+def disable():
+    """Stop recording; returns the counters that were active (or None)"""
+    counters = _calculator._branch_counters
+    _calculator._branch_counters = None
+    return counters
+
+
+def active():
+    return _calculator._branch_counters
+
+
+def _rounded(snapshot):
+    return {branch: {label: {'hits': entry['hits'], 'contribution': round(entry['contribution'], 2)}
+                     for label, entry in labels.items()}
+            for branch, labels in snapshot.items()}
+
+
+def to_json(snapshot, indent=2):
+    """JSON export with contributions rounded to the cent"""
+    return json.dumps(_rounded(snapshot), indent=indent, sort_keys=True)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(snapshot, prefix='reimbursement_branch'):
+    """Prometheus text exposition format: a hits counter and a contribution counter per branch"""
+    snapshot = _rounded(snapshot)
+    lines = []
+    for metric, field, help_text in (
+            ('hits_total', 'hits', "Claims that took each rule branch"),
+            ('contribution_dollars_total', 'contribution', "Dollars added (or removed) by each rule branch")):
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for branch, labels in snapshot.items():
+            for label, entry in labels.items():
+                lines.append(f'{prefix}_{metric}{{branch="{_escape(branch)}",label="{_escape(label)}"}} '
+                             f'{entry[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _count_chunk(args):
+    """Worker body: score a chunk with fresh counters and return their snapshot"""
+    chunk, batch = args
+    counters = enable(BranchCounters())
+    if batch:
+        days, miles, receipts = zip(*((row[0], row[1], row[2]) for row in chunk))
+        _calculator.calculate_reimbursement_batch(days, miles, receipts)
+    else:
+        for days, miles, receipts, *_ in chunk:
+            _calculator.calculate_reimbursement(days, miles, receipts)
+    disable()
+    return counters.snapshot()
+
+
+def count_branches(rows, workers=1, batch=False):
+    """Branch snapshot for scoring rows of (days, miles, receipts, ...), split over worker processes"""
+    if workers <= 1 or len(rows) < 2 * workers:
+        return _count_chunk((rows, batch))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunk_size = -(-len(rows) // (workers * 4))
+    chunks = [(rows[i:i + chunk_size], batch) for i in range(0, len(rows), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return merge_snapshots(*pool.map(_count_chunk, chunks))
+
+
+def main(argv=None):
+    import argparse
+
+    import case_store
+
+    parser = argparse.ArgumentParser(description="Count rule-branch hits over a case file")
+    parser.add_argument('cases', nargs='?', default='public_cases.json')
+    parser.add_argument('--workers', type=int, default=1, help="process pool size (default: in-process)")
+    parser.add_argument('--batch', action='store_true', help="score through the vectorized path")
+    parser.add_argument('--format', choices=('json', 'prometheus'), default='json')
+    args = parser.parse_args(argv)
+
+    rows = list(case_store.load_cases(args.cases).rows())
+    snapshot = count_branches(rows, args.workers, args.batch)
+    sys.stdout.write(to_json(snapshot) + '\n' if args.format == 'json' else to_prometheus(snapshot))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,239 +9,231 @@ KEY INSIGHTS FROM V8:
 - Only penalize specific cases that actually expect low outputs
 """
 
-import math
+from collections import namedtuple
 
-def calculate_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount):
+import reimbursement_rules as _rules
+
+# Set by branch_counters.enable(); None keeps instrumentation to a single check per call
+_branch_counters = None
+
+def calculate_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount, rules=None):
     """
     REFINED PATTERN DETECTION CALCULATOR V9
     
-    Ultra-precise pattern matching for penalties.
+    Ultra-precise pattern matching for penalties. The per-diem ladder, receipt
+    tiers and pattern windows live in reimbursement_rules (V9_RULES by default).
     """
-    
-    # COMPONENT 1: Base Per Diem with Aggressive Long Trip Penalties
-    if trip_duration_days == 1:
-        base_per_day = 96
-    elif trip_duration_days == 2:
-        base_per_day = 105
-    elif trip_duration_days == 3:
-        base_per_day = 108
-    elif trip_duration_days == 4:
-        base_per_day = 90
-    elif trip_duration_days == 5:
-        base_per_day = 75
-    elif trip_duration_days == 6:
-        base_per_day = 70
-    elif trip_duration_days == 7:
-        base_per_day = 65
-    elif trip_duration_days == 8:
-        base_per_day = 60
-    elif trip_duration_days == 9:
-        base_per_day = 55
-    elif trip_duration_days == 10:
-        base_per_day = 50
-    elif trip_duration_days == 11:
-        base_per_day = 45
-    elif trip_duration_days == 12:
-        base_per_day = 40
-    elif trip_duration_days == 13:
-        base_per_day = 35
-    elif trip_duration_days == 14:
-        base_per_day = 30
-    else:
-        base_per_day = 25
-    
-    base_amount = trip_duration_days * base_per_day
-    
-    # COMPONENT 2: Mileage Reimbursement - Standard Rate
-    mileage_amount = miles_traveled * 0.58
-    
-    # COMPONENT 3: Receipt Processing - Ultra-precise pattern detection
-    receipt_component = 0
-    
-    if total_receipts_amount > 0:
-        efficiency = miles_traveled / trip_duration_days if trip_duration_days > 0 else 0
-        
-        # Ultra-specific problematic patterns that actually expect low outputs
-        is_problematic_pattern = False
-        
-        # Pattern 1: SPECIFIC case: 5-day, high efficiency (100+ mi/day), receipts ~1800-1900, expects ~670
-        if (trip_duration_days == 5 and efficiency >= 100 and 
-            1800 <= total_receipts_amount <= 1900):
-            is_problematic_pattern = True
-        
-        # Pattern 2: SPECIFIC case: 1-day, extreme efficiency (1000+ mi/day), receipts ~1800, expects ~450  
-        elif (trip_duration_days == 1 and efficiency >= 1000 and 
-              1800 <= total_receipts_amount <= 1850):
-            is_problematic_pattern = True
-        
-        # Pattern 3: SPECIFIC case: 8-day, high efficiency (90+ mi/day), receipts ~1600-1700, expects ~650
-        elif (trip_duration_days == 8 and efficiency >= 90 and 
-              1600 <= total_receipts_amount <= 1700):
-            is_problematic_pattern = True
-        
-        # Pattern 4: SPECIFIC case: 5-day, low efficiency (<40 mi/day), receipts ~1200-1300, expects ~510
-        elif (trip_duration_days == 5 and efficiency < 40 and 
-              1200 <= total_receipts_amount <= 1300):
-            is_problematic_pattern = True
-        
-        if is_problematic_pattern:
-            # Apply targeted penalty for specific problematic patterns
-            if total_receipts_amount < 100:
-                receipt_component = total_receipts_amount * 0.3
-            elif total_receipts_amount < 500:
-                receipt_component = total_receipts_amount * 0.2
-            elif total_receipts_amount < 1000:
-                receipt_component = total_receipts_amount * 0.1
-            else:
-                receipt_component = total_receipts_amount * 0.05  # Heavy penalty
-        else:
-            # Normal receipt processing for all other patterns
-            if total_receipts_amount < 10:
-                receipt_component = total_receipts_amount * 1.0
-            elif total_receipts_amount < 100:
-                receipt_component = total_receipts_amount * 0.3
-            elif total_receipts_amount < 500:
-                receipt_component = total_receipts_amount * 0.5
-            elif total_receipts_amount < 1000:
-                receipt_component = total_receipts_amount * 0.7
-            elif total_receipts_amount < 2000:
-                receipt_component = total_receipts_amount * 0.5
-            else:
-                receipt_component = total_receipts_amount * 0.3
-    
+    rules = _rules.compile_rules(rules) if rules else _rules.ACTIVE_RULES
+    evaluation = _rules.evaluate_claim(rules, trip_duration_days, miles_traveled, total_receipts_amount)
+    if _branch_counters is not None:
+        _branch_counters.record(rules, trip_duration_days, total_receipts_amount, evaluation)
+    return round(evaluation[-1], 2)
+
+
+# Structured breakdown of one claim (see explain_reimbursement)
+ReimbursementBreakdown = namedtuple('ReimbursementBreakdown', [
+    'trip_duration_days', 'miles_traveled', 'total_receipts_amount', 'efficiency',
+    'base_per_day', 'base_amount', 'mileage_amount', 'receipt_tier', 'receipt_rate',
+    'receipt_component', 'pattern', 'adjustment', 'total_before_floor', 'floor_applied', 'result',
+])
+
+
+def explain_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount, rules=None):
+    """
+    Component attribution for one claim, from the same evaluation pass as the result.
+
+    Returns a ReimbursementBreakdown: per-component amounts, the receipt tier
+    and rate applied, the penalty pattern that fired (None if none), whether
+    the minimum floor clamped the total, and the rounded result.
+    """
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    (base_per_day, base_amount, mileage_amount, efficiency, pattern_index, receipt_tier,
+     receipt_rate, receipt_component, adjustment, total_before_floor, total) = _rules.evaluate_claim(
+        rules, trip_duration_days, miles_traveled, total_receipts_amount)
+
+    if receipt_tier is not None:
+        labels = rules.normal_tier_labels if pattern_index is None else rules.penalty_tier_labels
+        receipt_tier = labels[receipt_tier]
+    return ReimbursementBreakdown(
+        trip_duration_days, miles_traveled, total_receipts_amount, efficiency,
+        base_per_day, base_amount, mileage_amount, receipt_tier, receipt_rate,
+        receipt_component, rules.pattern_name(pattern_index), adjustment,
+        total_before_floor, rules.minimum > total_before_floor, round(total, 2),
+    )
+
+
+def _round_near_ties(total, cents, near_tie, result):
+    """
+    round(x, 2) for the near-half-cent entries, written into result.
+
+    x is above the midpoint (c + 0.5) / 100 exactly when 25 * x > (2c + 1) / 8.
+    A Veltkamp split x = hi + lo (26-bit halves) makes 25 * hi and 25 * lo exact,
+    and 25 * hi - (2c + 1) / 8 is exact too (Sterbenz: the two are within a
+    factor of 2), so the sign of the final sum is the sign of the exact difference.
+    """
+    import numpy as np
+
+    # The split needs positive values well inside the float range; anything else goes the scalar way
+    in_range = (total > 0) & (total < 2.0 ** 40)
+    ties = np.flatnonzero(near_tie & in_range)
+    x = total.flat[ties]
+    c = cents.flat[ties]
+    split = x * 134217729.0  # 2**27 + 1
+    hi = split - (split - x)
+    lo = x - hi
+    side = (25 * hi - (2 * c + 1) / 8) + 25 * lo
+    round_up = (side > 0) | ((side == 0) & (c % 2 == 1))  # exact ties go to the even cent
+    result.flat[ties] = np.where(round_up, c + 1, c) / 100
+    for i in np.flatnonzero(near_tie & ~in_range):
+        result.flat[i] = round(float(total.flat[i]), 2)
+
+
+def _evaluate_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules):
+    """Vectorized evaluation pass; returns every intermediate column as a dict of arrays"""
+    import numpy as np  # Deferred so the run.sh CLI path does not pay for it
+
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    days, miles, receipts = np.broadcast_arrays(
+        np.asarray(trip_duration_days, dtype=np.float64),
+        np.asarray(miles_traveled, dtype=np.float64),
+        np.asarray(total_receipts_amount, dtype=np.float64),
+    )
+
+    # COMPONENT 1: Base Per Diem (index 0 of the ladder holds the default rate)
+    per_diem_ladder = np.asarray(rules.per_diem_ladder, dtype=np.float64)
+    max_ladder_day = len(per_diem_ladder) - 1
+    ladder_index = np.where((days >= 1) & (days <= max_ladder_day) & (days == np.floor(days)), days, 0)
+    base_per_day = per_diem_ladder[ladder_index.astype(np.intp)]
+    base_amount = days * base_per_day
+
+    # COMPONENT 2: Mileage Reimbursement
+    mileage_amount = miles * rules.mileage_rate
+
+    # COMPONENT 3: Receipt Processing
+    with np.errstate(divide='ignore', invalid='ignore'):
+        efficiency = np.where(days > 0, miles / np.where(days > 0, days, 1), 0.0)
+
+    # First matching pattern wins, as in the scalar predicate table
+    pattern_index = np.full(days.shape, -1, dtype=np.intp)
+    for index, pattern_days, min_eff, max_eff, min_receipts, max_receipts, _ in rules.patterns:
+        matched = ((pattern_index < 0) & (days == pattern_days) &
+                   (receipts >= min_receipts) & (receipts <= max_receipts))
+        if min_eff is not None:
+            matched &= efficiency >= min_eff
+        if max_eff is not None:
+            matched &= efficiency < max_eff
+        pattern_index[matched] = index
+    is_problematic_pattern = pattern_index >= 0
+
+    penalty_tier = np.searchsorted(np.asarray(rules.penalty_bounds, dtype=np.float64), receipts, side='right')
+    normal_tier = np.searchsorted(np.asarray(rules.normal_bounds, dtype=np.float64), receipts, side='right')
+    receipt_rate = np.where(is_problematic_pattern,
+                            np.asarray(rules.penalty_rates, dtype=np.float64)[penalty_tier],
+                            np.asarray(rules.normal_rates, dtype=np.float64)[normal_tier])
+    has_receipts = receipts > 0
+    receipt_rate = np.where(has_receipts, receipt_rate, 0.0)
+    receipt_component = np.where(has_receipts, receipts * receipt_rate, 0.0)
+    # Index into normal labels + penalty labels; -1 (no receipts) is mapped to None by callers
+    receipt_tier = np.where(is_problematic_pattern, len(rules.normal_tier_labels) + penalty_tier, normal_tier)
+    receipt_tier = np.where(has_receipts, receipt_tier, -1)
+
     # COMPONENT 4: Adjustments
-    adjustment = 0
-    
-    # 5-day bonus - only reduced for ultra-specific problematic patterns
-    if trip_duration_days == 5:
-        efficiency = miles_traveled / trip_duration_days if trip_duration_days > 0 else 0
-        # Only reduce bonus for the specific patterns that expect low outputs
-        if ((efficiency >= 100 and 1800 <= total_receipts_amount <= 1900) or 
-            (efficiency < 40 and 1200 <= total_receipts_amount <= 1300)):
-            adjustment = 50  # Minimal bonus for ultra-specific problematic patterns
-        else:
-            adjustment = 300  # Normal bonus for all other 5-day trips
-    
-    # Long trip bonuses
-    if trip_duration_days >= 10:
-        adjustment += 200
-    if trip_duration_days >= 14:
-        adjustment += 400
-    
-    # FINAL CALCULATION
-    total_reimbursement = base_amount + mileage_amount + receipt_component + adjustment
-    
-    # Apply constraints
-    total_reimbursement = max(50, total_reimbursement)
-    
-    return round(total_reimbursement, 2)
+    reduces_bonus = np.array([pattern[6] for pattern in rules.patterns] + [False])
+    five_day_reduced = reduces_bonus[pattern_index]  # -1 picks the trailing False
+    adjustment = np.where(days == 5,
+                          np.where(five_day_reduced, rules.five_day_bonus_reduced, rules.five_day_bonus),
+                          0.0)
+    for min_days, bonus in rules.long_trip_bonuses:
+        adjustment = adjustment + np.where(days >= min_days, bonus, 0.0)
+
+    # FINAL CALCULATION - same summation order as the scalar path
+    total_before_floor = base_amount + mileage_amount + receipt_component + adjustment
+    total_reimbursement = np.maximum(float(rules.minimum), total_before_floor)
+
+    # np.round scales by 100 and can disagree with round() near a half cent, where round() compares
+    # the exact binary value with the midpoint. Near-ties get that exact comparison, vectorized.
+    result = np.round(total_reimbursement, 2)
+    scaled = total_reimbursement * 100
+    cents = np.floor(scaled)
+    near_tie = np.abs(scaled - cents - 0.5) < 1e-6
+    if near_tie.any():
+        _round_near_ties(total_reimbursement, cents, near_tie, result)
+
+    return {
+        'rules': rules,
+        'trip_duration_days': days,
+        'miles_traveled': miles,
+        'total_receipts_amount': receipts,
+        'efficiency': efficiency,
+        'base_per_day': base_per_day,
+        'base_amount': base_amount,
+        'mileage_amount': mileage_amount,
+        'receipt_tier_index': receipt_tier,
+        'receipt_rate': receipt_rate,
+        'receipt_component': receipt_component,
+        'pattern_index': pattern_index,
+        'adjustment': adjustment,
+        'total_before_floor': total_before_floor,
+        'floor_applied': float(rules.minimum) > total_before_floor,
+        'result': result,
+    }
+
+
+def calculate_reimbursement_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules=None):
+    """
+    Vectorized V9 calculator over arrays of trips.
+
+    Accepts NumPy arrays, scalars or any buffer-protocol object (array.array,
+    memoryview, ...) and returns a float64 array that matches
+    calculate_reimbursement element-for-element, bit-for-bit.
+    """
+    columns = _evaluate_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules)
+    if _branch_counters is not None:
+        _branch_counters.record_batch(columns)
+    return columns['result']
+
+
+def explain_reimbursement_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules=None):
+    """
+    Component attribution for many claims as parallel arrays.
+
+    Returns a dict keyed like ReimbursementBreakdown's fields (plus
+    pattern_index, -1 when no pattern fired). Label columns (receipt_tier,
+    pattern) are object arrays; pd.DataFrame(...) turns it into a table.
+    """
+    import numpy as np
 
+    columns = _evaluate_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules)
+    rules = columns.pop('rules')
+    tier_labels = np.array(list(rules.normal_tier_labels) + list(rules.penalty_tier_labels) + [None],
+                           dtype=object)
+    pattern_names = np.array([rules.pattern_name(i) for i in range(len(rules.patterns))] + [None],
+                             dtype=object)
+    columns['receipt_tier'] = tier_labels[columns.pop('receipt_tier_index')]
+    columns['pattern'] = pattern_names[columns['pattern_index']]
+    return {field: columns[field] for field in ReimbursementBreakdown._fields + ('pattern_index',)}
 
-def analyze_components(trip_duration_days, miles_traveled, total_receipts_amount):
+
+def analyze_components(trip_duration_days, miles_traveled, total_receipts_amount, rules=None):
     """
     Detailed breakdown of reimbursement components for analysis
     """
-    result = calculate_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount)
-    
-    # Calculate components
-    if trip_duration_days == 1:
-        base_per_day = 96
-    elif trip_duration_days == 2:
-        base_per_day = 105
-    elif trip_duration_days == 3:
-        base_per_day = 108
-    elif trip_duration_days == 4:
-        base_per_day = 90
-    elif trip_duration_days == 5:
-        base_per_day = 75
-    elif trip_duration_days == 6:
-        base_per_day = 70
-    elif trip_duration_days == 7:
-        base_per_day = 65
-    elif trip_duration_days == 8:
-        base_per_day = 60
-    elif trip_duration_days == 9:
-        base_per_day = 55
-    elif trip_duration_days == 10:
-        base_per_day = 50
-    elif trip_duration_days == 11:
-        base_per_day = 45
-    elif trip_duration_days == 12:
-        base_per_day = 40
-    elif trip_duration_days == 13:
-        base_per_day = 35
-    elif trip_duration_days == 14:
-        base_per_day = 30
-    else:
-        base_per_day = 25
-    
-    base_component = trip_duration_days * base_per_day
-    mileage_component = miles_traveled * 0.58
-    
-    # Receipt component with ultra-precise pattern detection
-    receipt_component = 0
-    efficiency = miles_traveled / trip_duration_days if trip_duration_days > 0 else 0
-    
-    is_problematic_pattern = False
-    if (trip_duration_days == 5 and efficiency >= 100 and 1800 <= total_receipts_amount <= 1900):
-        is_problematic_pattern = True
-    elif (trip_duration_days == 1 and efficiency >= 1000 and 1800 <= total_receipts_amount <= 1850):
-        is_problematic_pattern = True
-    elif (trip_duration_days == 8 and efficiency >= 90 and 1600 <= total_receipts_amount <= 1700):
-        is_problematic_pattern = True
-    elif (trip_duration_days == 5 and efficiency < 40 and 1200 <= total_receipts_amount <= 1300):
-        is_problematic_pattern = True
-    
-    if total_receipts_amount > 0:
-        if is_problematic_pattern:
-            if total_receipts_amount < 100:
-                receipt_component = total_receipts_amount * 0.3
-            elif total_receipts_amount < 500:
-                receipt_component = total_receipts_amount * 0.2
-            elif total_receipts_amount < 1000:
-                receipt_component = total_receipts_amount * 0.1
-            else:
-                receipt_component = total_receipts_amount * 0.05
-        else:
-            if total_receipts_amount < 10:
-                receipt_component = total_receipts_amount * 1.0
-            elif total_receipts_amount < 100:
-                receipt_component = total_receipts_amount * 0.3
-            elif total_receipts_amount < 500:
-                receipt_component = total_receipts_amount * 0.5
-            elif total_receipts_amount < 1000:
-                receipt_component = total_receipts_amount * 0.7
-            elif total_receipts_amount < 2000:
-                receipt_component = total_receipts_amount * 0.5
-            else:
-                receipt_component = total_receipts_amount * 0.3
-    
-    # Adjustments
-    adjustment = 0
-    if trip_duration_days == 5:
-        if ((efficiency >= 100 and 1800 <= total_receipts_amount <= 1900) or 
-            (efficiency < 40 and 1200 <= total_receipts_amount <= 1300)):
-            adjustment += 50
-        else:
-            adjustment += 300
-    if trip_duration_days >= 10:
-        adjustment += 200
-    if trip_duration_days >= 14:
-        adjustment += 400
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    breakdown = explain_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount, rules)
     
     print(f"\nREFINED PATTERN DETECTION BREAKDOWN:")
     print(f"Trip: {trip_duration_days} days, {miles_traveled} miles, ${total_receipts_amount:.2f} receipts")
-    print(f"Efficiency: {efficiency:.1f} miles/day")
-    if is_problematic_pattern:
+    print(f"Efficiency: {breakdown.efficiency:.1f} miles/day")
+    if breakdown.pattern is not None:
         print(f"*** ULTRA-SPECIFIC PROBLEMATIC PATTERN DETECTED ***")
-    print(f"Base per diem: {trip_duration_days} × ${base_per_day:.2f} = ${base_component:.2f}")
-    print(f"Mileage: {miles_traveled} × $0.58 = ${mileage_component:.2f}")
-    print(f"Receipts: ${receipt_component:.2f}")
-    if adjustment != 0:
-        print(f"Adjustment: ${adjustment}")
-    print(f"TOTAL: ${result:.2f}")
+    print(f"Base per diem: {trip_duration_days} × ${breakdown.base_per_day:.2f} = ${breakdown.base_amount:.2f}")
+    print(f"Mileage: {miles_traveled} × ${rules.mileage_rate:.2f} = ${breakdown.mileage_amount:.2f}")
+    print(f"Receipts: ${breakdown.receipt_component:.2f}")
+    if breakdown.adjustment != 0:
+        print(f"Adjustment: ${breakdown.adjustment}")
+    print(f"TOTAL: ${breakdown.result:.2f}")
     
-    return result
+    return breakdown.result
 
 
 def test_algorithm():
@@ -297,7 +289,11 @@ def main():
     """Command line interface for run.sh integration"""
     import sys
     
-    if len(sys.argv) == 4:
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        # Long-lived server mode, see reimbursement_server.py
+        from reimbursement_server import main as serve
+        serve(sys.argv[2:])
+    elif len(sys.argv) == 4:
         try:
             days = int(sys.argv[1])
             miles = float(sys.argv[2])
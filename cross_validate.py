@@ -0,0 +1,254 @@
+"""
+K-FOLD CROSS-VALIDATION
+How well does a calculator do on cases it was not tuned on?
+
+The public cases are split into k folds (shuffled with a seed, optionally
+stratified so every fold gets the same mix of day counts or receipt tiers).
+For each fold, every candidate is fitted on the other k-1 folds and scored on
+the held-out one with the eval.sh formula. Candidates:
+- fit         re-tune the rule constants on the training split (fit_parameters' coordinate descent)
+- residual    train a residual model on the training split (residual_model.py) on top of V9
+- <version>   any algorithm_registry version (v9, rules/x, models/x) scored as-is; a version
+              tuned on these same cases is not really held out, which is what the comparison shows
+
+Fold x candidate tasks run on a process pool. The case columns are copied once
+into a multiprocessing.shared_memory block that every worker maps read-only,
+so nothing is re-parsed or pickled per task.
+
+The report gives each fold's held-out score (on that fold's cases), the mean,
+standard deviation and variance across folds, the pooled score of all held-out
+predictions together (comparable to a full eval.sh run), and the average error
+on the training split next to the held-out one: a large gap means overfitting.
+
+Usage:
+    python3 cross_validate.py [--cases public_cases.json] [-k 5] [--candidates v9,residual,fit]
+                              [--stratify days|receipts] [--seed 0] [--workers N] [--fit-rounds 30] [--json]
+"""
+
+import os
+import statistics
+import sys
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement_batch
+import case_store
+from error_metrics import ErrorMetrics
+import reimbursement_rules as _rules
+
+STRATIFY = ('days', 'receipts')
+
+
+def assign_folds(days, receipts, k=5, stratify=None, seed=0):
+    """Fold number (0..k-1) for every case; stratified folds deal each stratum out in turn"""
+    count = len(days)
+    if k < 2 or k > count:
+        raise ValueError(f"need 2 <= k <= {count} cases, got k={k}")
+    rng = np.random.default_rng(seed)
+    if stratify is None:
+        strata = np.zeros(count, dtype=np.int64)
+    elif stratify == 'days':
+        strata = np.asarray(days, dtype=np.int64)
+    elif stratify == 'receipts':
+        strata = np.searchsorted(np.asarray(_rules.DEFAULT_RULES.normal_bounds, dtype=np.float64),
+                                 np.asarray(receipts, dtype=np.float64), side='right')
+    else:
+        raise ValueError(f"unknown stratification {stratify!r}; use one of {', '.join(STRATIFY)}")
+
+    folds = np.empty(count, dtype=np.int64)
+    offset = 0
+    for stratum in np.unique(strata):
+        members = rng.permutation(np.flatnonzero(strata == stratum))
+        # Continue the round-robin across strata so small strata do not all land in fold 0
+        folds[members] = (np.arange(len(members)) + offset) % k
+        offset += len(members)
+    return folds
+
+
+# CANDIDATES: each takes training columns and returns a batch scorer (days, miles, receipts) -> results
+
+def _fit_rules(days, miles, receipts, expected, options):
+    import copy
+
+    import fit_parameters
+
+    base_rules = copy.deepcopy(_rules.V9_RULES)
+    spec = fit_parameters.parameter_spec(base_rules)
+    objective = fit_parameters.make_objective(case_store.CaseStore(None, days, miles, receipts, expected))
+    _, vector = fit_parameters.coordinate_descent(fit_parameters.rules_to_vector(base_rules, spec), spec, base_rules,
+                                                  objective, options.get('fit_rounds', 30))
+    rules = _rules.CompiledRules(fit_parameters.vector_to_rules(vector, spec, base_rules))
+    return lambda d, m, r: calculate_reimbursement_batch(d, m, r, rules=rules)
+
+
+def _fit_residual(days, miles, receipts, expected, options):
+    from residual_model import ResidualCalculator, train
+
+    return ResidualCalculator(train(days, miles, receipts, expected, rules=_rules.DEFAULT_RULES),
+                              _rules.DEFAULT_RULES).batch
+
+
+TRAINABLE = {'fit': _fit_rules, 'residual': _fit_residual}
+
+
+def _candidate(name, days, miles, receipts, expected, options):
+    if name in TRAINABLE:
+        return TRAINABLE[name](days, miles, receipts, expected, options)
+    import algorithm_registry
+
+    return algorithm_registry.get(name).score
+
+
+# Workers map the shared case block once, in the initializer
+_worker_state = {}
+
+
+def _init_worker(block_name, count, folds, options):
+    from multiprocessing import shared_memory
+
+    # Pool workers share the parent's resource tracker, so attaching adds no second owner
+    block = shared_memory.SharedMemory(name=block_name)
+    columns = np.ndarray((4, count), dtype=np.float64, buffer=block.buf)
+    columns.flags.writeable = False
+    _worker_state.update(block=block, columns=columns, folds=folds, options=options)
+
+
+def _metrics(expected, results):
+    metrics = ErrorMetrics(top=0)
+    metrics.add_batch(expected, results)
+    return metrics
+
+
+def _run_fold(task):
+    """Fit one candidate on every fold but one and score the held-out fold"""
+    name, fold = task
+    days, miles, receipts, expected = _worker_state['columns']
+    held_out = _worker_state['folds'] == fold
+    training = ~held_out
+    scorer = _candidate(name, days[training], miles[training], receipts[training], expected[training],
+                        _worker_state['options'])
+    train_metrics = _metrics(expected[training], scorer(days[training], miles[training], receipts[training]))
+    test_metrics = _metrics(expected[held_out], scorer(days[held_out], miles[held_out], receipts[held_out]))
+    return name, fold, train_metrics, test_metrics
+
+
+def cross_validate(cases_path='public_cases.json', candidates=('v9', 'residual'), k=5, stratify=None, seed=0,
+                   workers=None, options=None):
+    """Run every candidate over k folds; returns the report dict"""
+    from multiprocessing import shared_memory
+
+    store = case_store.load_cases(cases_path)
+    if not store.has_expected:
+        raise ValueError(f"{cases_path} has no expected outputs to validate against")
+    count = len(store)
+    folds = assign_folds(store.days, store.receipts, k, stratify, seed)
+    options = options or {}
+    tasks = [(name, fold) for name in candidates for fold in range(k)]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    block = shared_memory.SharedMemory(create=True, size=4 * count * 8)
+    try:
+        columns = np.ndarray((4, count), dtype=np.float64, buffer=block.buf)
+        for row, column in enumerate((store.days, store.miles, store.receipts, store.expected)):
+            columns[row] = column
+        columns.flags.writeable = False
+        if workers <= 1:
+            _worker_state.update(columns=columns, folds=folds, options=options)
+            try:
+                outcomes = [_run_fold(task) for task in tasks]
+            finally:
+                _worker_state.clear()
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(block.name, count, folds, options)) as pool:
+                outcomes = list(pool.map(_run_fold, tasks))
+    finally:
+        del columns
+        block.close()
+        block.unlink()
+
+    report = {'cases': count, 'k': k, 'stratify': stratify, 'seed': seed, 'candidates': {}}
+    for name in candidates:
+        own = sorted((outcome for outcome in outcomes if outcome[0] == name), key=lambda outcome: outcome[1])
+        pooled = ErrorMetrics(top=0)
+        fold_reports = []
+        for _, fold, train_metrics, test_metrics in own:
+            pooled.merge(test_metrics)
+            train_summary, test_summary = train_metrics.summary(), test_metrics.summary()
+            fold_reports.append({'fold': fold, 'cases': test_summary['total_cases'], 'score': test_summary['score'],
+                                 'average_error': test_summary['average_error'],
+                                 'exact_matches': test_summary['exact_matches'],
+                                 'train_average_error': train_summary['average_error']})
+        scores = [entry['score'] for entry in fold_reports]
+        pooled_summary = pooled.summary()
+        report['candidates'][name] = {
+            'folds': fold_reports,
+            'mean_score': statistics.mean(scores),
+            'stdev_score': statistics.stdev(scores) if len(scores) > 1 else 0.0,
+            'variance_score': statistics.variance(scores) if len(scores) > 1 else 0.0,
+            'pooled_score': pooled_summary['score'],
+            'pooled_average_error': pooled_summary['average_error'],
+            'train_average_error': statistics.mean(entry['train_average_error'] for entry in fold_reports),
+        }
+    return report
+
+
+def print_report(report):
+    stratified = f", stratified by {report['stratify']}" if report['stratify'] else ''
+    print(f"{report['k']}-fold cross-validation over {report['cases']} cases (seed {report['seed']}{stratified})")
+    for name, entry in report['candidates'].items():
+        print(f"\n{name}")
+        for fold in entry['folds']:
+            print(f"  fold {fold['fold']}: {fold['cases']} cases, score {fold['score']:.2f}, "
+                  f"avg error ${fold['average_error']:.2f} (train ${fold['train_average_error']:.2f})")
+        print(f"  fold score {entry['mean_score']:.2f} ± {entry['stdev_score']:.2f} "
+              f"(variance {entry['variance_score']:.2f})")
+        print(f"  pooled held-out score {entry['pooled_score']:.2f}, avg error ${entry['pooled_average_error']:.2f} "
+              f"vs ${entry['train_average_error']:.2f} on training splits")
+    ranked = sorted(report['candidates'].items(), key=lambda item: item[1]['pooled_score'])
+    print(f"\nBest generalization: {ranked[0][0]} (pooled score {ranked[0][1]['pooled_score']:.2f})")
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="k-fold cross-validation of calculator candidates")
+    parser.add_argument('--cases', default='public_cases.json', help="public-format case file")
+    parser.add_argument('-k', type=int, default=5, help="number of folds")
+    parser.add_argument('--candidates', default='v9,residual',
+                        help="comma-separated: fit, residual, or algorithm_registry versions")
+    parser.add_argument('--stratify', choices=STRATIFY, help="balance folds by day count or receipt tier")
+    parser.add_argument('--seed', type=int, default=0, help="fold shuffle seed")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--fit-rounds', type=int, default=30, help="coordinate-descent rounds for 'fit'")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    candidates = [name.strip() for name in args.candidates.split(',') if name.strip()]
+    unknown = [name for name in candidates if name not in TRAINABLE]
+    if unknown:
+        import algorithm_registry
+
+        try:
+            for name in unknown:
+                algorithm_registry.get(name)
+        except KeyError as error:
+            parser.error(error.args[0])
+    try:
+        report = cross_validate(args.cases, candidates, args.k, args.stratify, args.seed, args.workers,
+                                {'fit_rounds': args.fit_rounds})
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+STREAMING ERROR METRICS
+eval.sh's metrics in constant memory, one result or one batch at a time.
+
+ErrorMetrics keeps:
+- exact (< $0.01) and close (< $1.00) match counts
+- the total error (exact Decimal, so the average and score match eval.sh digit
+  for digit) and the maximum error with the first case that reached it
+- a log-bucketed histogram of errors for approximate percentiles (within 0.5%
+  relative error; fixed number of buckets)
+- a bounded heap of the top-K worst cases
+
+Errors are taken between the printed decimal values, as eval.sh does. Results
+and expected values that sit on whole cents (the normal case) are handled as
+integer cents; anything else falls back to Decimal per value.
+
+Accumulators built in separate workers combine with merge(), provided they
+numbered their cases globally (pass first_case / case).
+
+    metrics = ErrorMetrics(top=5)
+    metrics.add(expected, actual, days, miles, receipts)
+    metrics.add_batch(expected_array, result_array, rows)
+    metrics.summary()               # the evaluate.summarize() dict
+    metrics.percentiles((50, 90, 99))
+
+From the shell (streams the case file; results from a file or scored in chunks):
+    python3 error_metrics.py [cases.json] [--results results.txt] [--workers N] [--top 5] [--json]
+"""
+
+import heapq
+import math
+import sys
+from decimal import Decimal, ROUND_DOWN
+
+import numpy as np
+
+EXACT = Decimal('0.01')
+CLOSE = Decimal('1.0')
+
+
+def _truncate(value, places):
+    """bc-style truncation to a fixed number of decimal places"""
+    return value.quantize(Decimal(1).scaleb(-places), rounding=ROUND_DOWN)
+
+
+class ErrorHistogram:
+    """
+    Fixed-size log-bucketed histogram (the DDSketch layout): bucket i >= 1 covers
+    (MIN * GAMMA**(i-2), MIN * GAMMA**(i-1)], errors under a cent share bucket 0.
+    """
+
+    ACCURACY = 0.005
+    GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+    MIN = 0.01
+    MAX = 1e9
+
+    def __init__(self):
+        self._log_gamma = math.log(self.GAMMA)
+        self.buckets = int(math.ceil(math.log(self.MAX / self.MIN) / self._log_gamma)) + 2
+        self.counts = np.zeros(self.buckets, dtype=np.int64)
+
+    def _index(self, errors):
+        errors = np.asarray(errors, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = np.ceil(np.log(np.maximum(errors, self.MIN) / self.MIN) / self._log_gamma) + 1
+        index = np.where(errors < self.MIN, 0, index)
+        return np.clip(index, 0, self.buckets - 1).astype(np.intp)
+
+    def add(self, error):
+        if error < self.MIN:
+            index = 0
+        else:
+            index = min(int(math.ceil(math.log(error / self.MIN) / self._log_gamma)) + 1, self.buckets - 1)
+        self.counts[index] += 1
+
+    def add_batch(self, errors):
+        self.counts += np.bincount(self._index(errors).ravel(), minlength=self.buckets)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def quantile(self, q):
+        """Approximate q-quantile (0..1) of the added errors, or None when empty"""
+        total = int(self.counts.sum())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank, side='right'))
+        if index == 0:
+            return 0.0
+        # Midpoint of the bucket in relative terms, so the estimate is within ACCURACY
+        return self.MIN * self.GAMMA ** (index - 1) * 2 / (self.GAMMA + 1)
+
+
+class ErrorMetrics:
+    """Mergeable, constant-memory accumulator for eval.sh's metrics"""
+
+    def __init__(self, top=5):
+        self.top = top
+        self.total_cases = 0
+        self.successful_runs = 0
+        self.exact_matches = 0
+        self.close_matches = 0
+        self.total_cents = 0                 # batch errors on whole cents, summed exactly
+        self.total_error_other = Decimal(0)  # everything else, as Decimal
+        self.max_error = Decimal(0)
+        self.max_error_case = None
+        self.histogram = ErrorHistogram()
+        self._worst = []  # min-heap of (error, -case, row) holding the top-K
+
+    @property
+    def total_error(self):
+        return Decimal(self.total_cents).scaleb(-2) + self.total_error_other
+
+    def record_failure(self, count=1):
+        """Count cases that produced no result (they still cost 0.1 in the score)"""
+        self.total_cases += count
+
+    def _push(self, error, case, row):
+        if not self.top:
+            return
+        item = (error, -case, row)
+        if len(self._worst) < self.top:
+            heapq.heappush(self._worst, item)
+        elif item[:2] > self._worst[0][:2]:
+            heapq.heapreplace(self._worst, item)
+
+    def add(self, expected, actual, trip_duration_days=None, miles_traveled=None, total_receipts_amount=None,
+            case=None):
+        """Record one result; case defaults to the next number in sequence"""
+        case = self.total_cases + 1 if case is None else case
+        error = abs(Decimal(str(actual)) - Decimal(str(expected)))
+        self.total_cases += 1
+        self.successful_runs += 1
+        if error < EXACT:
+            self.exact_matches += 1
+        if error < CLOSE:
+            self.close_matches += 1
+        self.total_error_other += error
+        if error > self.max_error:
+            self.max_error = error
+            self.max_error_case = case
+        self.histogram.add(float(error))
+        self._push(error, case, (trip_duration_days, miles_traveled, total_receipts_amount, expected, actual))
+
+    def add_batch(self, expected, actual, rows=None, first_case=None):
+        """
+        Record a batch of results. rows, if given, is indexed like expected and
+        holds (days, miles, receipts, ...) for the worst-case report; only the
+        top-K candidates are read from it.
+        """
+        expected_values = expected
+        actual_values = actual
+        expected = np.asarray(expected, dtype=np.float64).ravel()
+        actual = np.asarray(actual, dtype=np.float64).ravel()
+        count = len(expected)
+        if len(actual) != count:
+            raise ValueError(f"{count} expected values but {len(actual)} results")
+        first_case = self.total_cases + 1 if first_case is None else first_case
+        self.total_cases += count
+        self.successful_runs += count
+        if not count:
+            return
+
+        # Whole-cent values: the decimal repr of x is exactly round(x * 100) / 100
+        expected_cents = np.round(expected * 100)
+        actual_cents = np.round(actual * 100)
+        on_cents = ((expected_cents / 100 == expected) & (actual_cents / 100 == actual) &
+                    (np.abs(expected_cents) < 2 ** 50) & (np.abs(actual_cents) < 2 ** 50))
+        error_cents = np.abs(actual_cents - expected_cents)
+        errors = error_cents / 100  # float dollars; exact-enough keys for ranking and the histogram
+        decimal_errors = {}
+        for i in np.flatnonzero(~on_cents).tolist():
+            error = abs(Decimal(str(_item(actual_values, i))) - Decimal(str(_item(expected_values, i))))
+            decimal_errors[i] = error
+            errors[i] = float(error)
+
+        cents = error_cents[on_cents].astype(np.int64)
+        self.exact_matches += int(np.count_nonzero(cents < 1))
+        self.close_matches += int(np.count_nonzero(cents < 100))
+        self.total_cents += int(cents.sum())
+        for error in decimal_errors.values():
+            if error < EXACT:
+                self.exact_matches += 1
+            if error < CLOSE:
+                self.close_matches += 1
+            self.total_error_other += error
+        self.histogram.add_batch(errors)
+
+        def exact_error(i):
+            if i in decimal_errors:
+                return decimal_errors[i]
+            return Decimal(int(error_cents[i])).scaleb(-2)
+
+        peak = int(np.argmax(errors))
+        candidates = np.flatnonzero(errors == errors[peak]).tolist()
+        peak_error, peak = max((exact_error(i), -i) for i in candidates)
+        if peak_error > self.max_error:
+            self.max_error = peak_error
+            self.max_error_case = first_case - peak
+
+        if self.top:
+            if count <= self.top:
+                candidates = range(count)
+            else:
+                kth = np.partition(errors, count - self.top)[count - self.top]
+                above = np.flatnonzero(errors > kth).tolist()
+                tied = np.flatnonzero(errors == kth)[:self.top - len(above)].tolist()
+                candidates = above + tied
+            for i in candidates:
+                row = rows[i] if rows is not None else (None, None, None)
+                self._push(exact_error(i), first_case + i,
+                           (row[0], row[1], row[2], _item(expected_values, i), _item(actual_values, i)))
+
+    def merge(self, other):
+        """Fold in another accumulator (e.g. from a worker that scored a different range of cases)"""
+        self.total_cases += other.total_cases
+        self.successful_runs += other.successful_runs
+        self.exact_matches += other.exact_matches
+        self.close_matches += other.close_matches
+        self.total_cents += other.total_cents
+        self.total_error_other += other.total_error_other
+        if other.max_error > self.max_error or (
+                other.max_error == self.max_error and other.max_error_case is not None
+                and (self.max_error_case is None or other.max_error_case < self.max_error_case)):
+            self.max_error = other.max_error
+            self.max_error_case = other.max_error_case
+        self.histogram.merge(other.histogram)
+        for error, neg_case, row in other._worst:
+            self._push(error, -neg_case, row)
+        return self
+
+    def percentiles(self, points=(50, 90, 95, 99)):
+        """{'p50': dollars, ...} approximate error percentiles"""
+        return {f'p{point:g}': self.histogram.quantile(point / 100) for point in points}
+
+    def worst_cases(self):
+        worst = []
+        for error, neg_case, (days, miles, receipts, expected, actual) in sorted(self._worst, reverse=True):
+            worst.append({
+                'case': -neg_case,
+                'trip_duration_days': days,
+                'miles_traveled': miles,
+                'total_receipts_amount': receipts,
+                'expected': expected,
+                'actual': actual,
+                'error': float(error),
+            })
+        return worst
+
+    def summary(self):
+        """Aggregate metrics in evaluate.summarize()'s shape"""
+        successful_runs = self.successful_runs
+        avg_error = _truncate(self.total_error / successful_runs, 2) if successful_runs else Decimal(0)
+        score = _truncate(avg_error * 100 + (self.total_cases - self.exact_matches) * Decimal('0.1'), 2)
+        return {
+            'total_cases': self.total_cases,
+            'successful_runs': successful_runs,
+            'exact_matches': self.exact_matches,
+            'exact_pct': float(_truncate(Decimal(self.exact_matches * 100) / successful_runs, 1))
+            if successful_runs else 0.0,
+            'close_matches': self.close_matches,
+            'close_pct': float(_truncate(Decimal(self.close_matches * 100) / successful_runs, 1))
+            if successful_runs else 0.0,
+            'average_error': float(avg_error),
+            'max_error': float(self.max_error),
+            'max_error_case': self.max_error_case,
+            'score': float(score),
+            'worst_cases': self.worst_cases() if self.exact_matches < self.total_cases else [],
+        }
+
+
+def _item(values, i):
+    value = values[i]
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _score_range(args):
+    """Worker body: stream cases [start, stop) of a case file into a fresh accumulator"""
+    import case_store
+    from calculate_reimbursement import calculate_reimbursement_batch
+
+    path, start, stop, top, chunk_size = args
+    store = case_store.load_cases(path)
+    metrics = ErrorMetrics(top)
+    for offset in range(start, stop, chunk_size):
+        end = min(offset + chunk_size, stop)
+        days, miles, receipts = store.days[offset:end], store.miles[offset:end], store.receipts[offset:end]
+        rows = _Rows(days, miles, receipts)
+        metrics.add_batch(store.expected[offset:end], calculate_reimbursement_batch(days, miles, receipts),
+                          rows, first_case=offset + 1)
+    return metrics
+
+
+class _Rows:
+    """(days, miles, receipts) rows over column arrays, built only for the rows asked for"""
+
+    def __init__(self, *columns):
+        self.columns = columns
+
+    def __getitem__(self, i):
+        days, *amounts = (column[i].item() for column in self.columns)
+        # Integral amounts print as ints, as they appear in the JSON (case_store.rows() does the same)
+        return (days, *(int(amount) if float(amount).is_integer() else amount for amount in amounts))
+
+
+def evaluate_file(cases_path, results_path=None, workers=1, top=5, chunk_size=65536):
+    """ErrorMetrics for a public-format case file, scored in chunks (or read from results_path)"""
+    import case_store
+
+    store = case_store.load_cases(cases_path)
+    if not store.has_expected:
+        raise ValueError(f"{cases_path} has no expected outputs to score against")
+    total = len(store)
+
+    if results_path:
+        metrics = ErrorMetrics(top)
+        rows = _Rows(store.days, store.miles, store.receipts)
+        with open(results_path) as f:
+            for case in range(total):
+                line = f.readline()
+                if not line:
+                    metrics.record_failure(total - case)
+                    break
+                try:
+                    actual = float(line)
+                except ValueError:
+                    metrics.record_failure()
+                    continue
+                metrics.add(store.expected[case].item(), actual, *rows[case], case=case + 1)
+        return metrics
+
+    if workers <= 1 or total < 2 * workers:
+        return _score_range((cases_path, 0, total, top, chunk_size))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    span = -(-total // workers)
+    ranges = [(cases_path, start, min(start + span, total), top, chunk_size) for start in range(0, total, span)]
+    metrics = ErrorMetrics(top)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(_score_range, ranges):
+            metrics.merge(partial)
+    return metrics
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    import evaluate
+
+    parser = argparse.ArgumentParser(description="eval.sh metrics in constant memory, with error percentiles")
+    parser.add_argument('cases', nargs='?', default='public_cases.json', help="public-format case file")
+    parser.add_argument('--results', help="one result per line for each case (default: score them)")
+    parser.add_argument('--workers', type=int, default=1, help="process pool size (default: in-process)")
+    parser.add_argument('--top', type=int, default=5, help="worst cases to keep")
+    parser.add_argument('--json', action='store_true', help="emit machine-readable JSON")
+    args = parser.parse_args(argv)
+
+    metrics = evaluate_file(args.cases, args.results, args.workers, args.top)
+    summary = metrics.summary()
+    summary['percentiles'] = metrics.percentiles()
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+        return
+    evaluate.print_report(summary)
+    print()
+    print("📊 Error percentiles (±0.5%):")
+    print("  " + ", ".join(f"{name} ${value:.2f}" for name, value in summary['percentiles'].items()
+                           if value is not None))
+
+
+if __name__ == "__main__":
+    main()
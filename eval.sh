@@ -51,9 +51,12 @@ fi
 echo "📊 Running evaluation against 1,000 test cases..."
 echo
 
-# Extract all test data upfront in a single jq call for better performance
+# Extract all test data upfront in a single call for better performance
+# (the columnar case cache when available, otherwise a single jq pass)
 echo "Extracting test data..."
-test_data=$(jq -r '.[] | "\(.input.trip_duration_days):\(.input.miles_traveled):\(.input.total_receipts_amount):\(.expected_output)"' public_cases.json)
+if ! test_data=$(python3 case_store.py dump public_cases.json 2>/dev/null); then
+    test_data=$(jq -r '.[] | "\(.input.trip_duration_days):\(.input.miles_traveled):\(.input.total_receipts_amount):\(.expected_output)"' public_cases.json)
+fi
 
 # Convert to arrays for faster access (compatible with bash 3.2+)
 test_cases=()
@@ -0,0 +1,108 @@
+"""
+IN-PROCESS EVALUATION HARNESS
+Python replacement for eval.sh's fork-per-case / bc-per-metric loop.
+
+Loads public_cases.json once, scores every case with calculate_reimbursement
+(optionally across a process pool) and reports the same numbers eval.sh prints:
+exact/close matches, average and maximum error, the score and the top-5 worst
+cases. Errors are computed on the printed decimal values, and the average, score
+and percentages are truncated the way bc's `scale=` does, so the numbers agree
+with eval.sh digit for digit.
+
+Usage:
+    python3 evaluate.py [cases.json] [--workers N] [--json]
+"""
+
+import json
+import sys
+
+from calculate_reimbursement import calculate_reimbursement
+import case_store
+from error_metrics import ErrorMetrics
+
+
+def load_cases(path='public_cases.json'):
+    """Load (days, miles, receipts, expected) tuples from a public-format case file"""
+    store = case_store.load_cases(path)
+    if not store.has_expected:
+        raise ValueError(f"{path} has no expected outputs to score against")
+    return list(store.rows())
+
+
+def _score_chunk(chunk):
+    """Worker body: compute results for a list of (days, miles, receipts[, expected])"""
+    return [calculate_reimbursement(days, miles, receipts) for days, miles, receipts, *_ in chunk]
+
+
+def compute_results(cases, workers=1):
+    """Results for every case, in order; workers > 1 spreads chunks over a process pool"""
+    if workers <= 1 or len(cases) < 2 * workers:
+        return _score_chunk(cases)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunk_size = -(-len(cases) // (workers * 4))
+    chunks = [cases[i:i + chunk_size] for i in range(0, len(cases), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_results in pool.map(_score_chunk, chunks):
+            results.extend(chunk_results)
+    return results
+
+
+def summarize(cases, results, top=5):
+    """Aggregate eval.sh metrics for cases and their computed results"""
+    metrics = ErrorMetrics(top)
+    scored = min(len(cases), len(results))
+    metrics.add_batch([case[3] for case in cases[:scored]], results[:scored], cases)
+    metrics.record_failure(len(cases) - scored)
+    return metrics.summary()
+
+
+def print_report(summary):
+    """Human-readable report in the same shape as eval.sh"""
+    print("✅ Evaluation Complete!")
+    print()
+    print("📈 Results Summary:")
+    print(f"  Total test cases: {summary['total_cases']}")
+    print(f"  Successful runs: {summary['successful_runs']}")
+    print(f"  Exact matches (±$0.01): {summary['exact_matches']} ({summary['exact_pct']:.1f}%)")
+    print(f"  Close matches (±$1.00): {summary['close_matches']} ({summary['close_pct']:.1f}%)")
+    print(f"  Average error: ${summary['average_error']:.2f}")
+    print(f"  Maximum error: ${summary['max_error']:.2f}")
+    print()
+    print(f"🎯 Your Score: {summary['score']:.2f} (lower is better)")
+
+    if summary['worst_cases']:
+        print()
+        print("💡 Tips for improvement:")
+        print("  Check these high-error cases:")
+        for case in summary['worst_cases']:
+            print(f"    Case {case['case']}: {case['trip_duration_days']} days, "
+                  f"{case['miles_traveled']} miles, ${case['total_receipts_amount']} receipts")
+            print(f"      Expected: ${case['expected']:.2f}, Got: ${case['actual']:.2f}, "
+                  f"Error: ${case['error']:.2f}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score calculate_reimbursement against historical cases")
+    parser.add_argument('cases', nargs='?', default='public_cases.json', help="public-format case file")
+    parser.add_argument('--workers', type=int, default=1, help="process pool size (default: in-process)")
+    parser.add_argument('--json', action='store_true', help="emit machine-readable JSON")
+    args = parser.parse_args(argv)
+
+    cases = load_cases(args.cases)
+    results = compute_results(cases, args.workers)
+    summary = summarize(cases, results)
+
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+AUTOMATIC PARAMETER FITTING
+Re-tune the V9 constants against historical cases instead of by hand.
+
+The numeric constants of a rule set (per-diem ladder, mileage rate, receipt tier
+rates and bounds, bonuses, pattern windows) are flattened into a parameter
+vector. Each candidate vector is turned back into a rule set and scored with the
+vectorized calculator over every case at once. Coordinate descent with shrinking
+step sizes runs from the starting rules plus a number of randomly perturbed
+restarts, spread over a process pool; the best vector is written out as a
+rules file that calculate_reimbursement can load directly.
+
+Usage:
+    python3 fit_parameters.py [--cases public_cases.json] [--start rules/v9.json]
+                              [--restarts 8] [--workers N] [--loss score|mae|mse]
+                              [--groups per_diem,mileage,...] [-o rules/fitted.json]
+"""
+
+import copy
+import os
+import sys
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement_batch
+import case_store
+import reimbursement_rules as _rules
+
+PARAMETER_GROUPS = ('per_diem', 'mileage', 'receipt_rates', 'receipt_bounds', 'bonuses', 'pattern_windows')
+
+
+def parameter_spec(rules, groups=PARAMETER_GROUPS):
+    """
+    List of (path, lower, upper, initial_step) for every tunable constant.
+
+    path is a tuple of keys/indexes into the rules dict.
+    """
+    spec = []
+    if 'per_diem' in groups:
+        for i in range(len(rules['per_diem']['by_days'])):
+            spec.append((('per_diem', 'by_days', i), 0.0, 300.0, 8.0))
+        spec.append((('per_diem', 'default'), 0.0, 300.0, 8.0))
+    if 'mileage' in groups:
+        spec.append((('mileage_rate',), 0.0, 2.0, 0.05))
+    for tier in ('normal', 'penalty'):
+        if 'receipt_rates' in groups:
+            for i in range(len(rules['receipt_tiers'][tier]['rates'])):
+                spec.append((('receipt_tiers', tier, 'rates', i), 0.0, 2.0, 0.1))
+        if 'receipt_bounds' in groups:
+            for i in range(len(rules['receipt_tiers'][tier]['bounds'])):
+                spec.append((('receipt_tiers', tier, 'bounds', i), 0.0, 5000.0, 50.0))
+    if 'bonuses' in groups:
+        spec.append((('five_day_bonus', 'normal'), 0.0, 1000.0, 50.0))
+        spec.append((('five_day_bonus', 'reduced'), 0.0, 1000.0, 50.0))
+        for i in range(len(rules['long_trip_bonuses'])):
+            spec.append((('long_trip_bonuses', i, 1), 0.0, 1000.0, 50.0))
+        spec.append((('minimum_reimbursement',), 0.0, 500.0, 10.0))
+    if 'pattern_windows' in groups:
+        for i, pattern in enumerate(rules['penalty_patterns']):
+            for key in ('min_receipts', 'max_receipts'):
+                spec.append((('penalty_patterns', i, key), 0.0, 5000.0, 25.0))
+            for key in ('min_efficiency', 'max_efficiency'):
+                if pattern.get(key) is not None:
+                    spec.append((('penalty_patterns', i, key), 0.0, 2000.0, 10.0))
+    return spec
+
+
+def _get(rules, path):
+    for key in path:
+        rules = rules[key]
+    return rules
+
+
+def rules_to_vector(rules, spec):
+    return np.array([_get(rules, path) for path, *_ in spec], dtype=np.float64)
+
+
+def vector_to_rules(vector, spec, base_rules):
+    """A copy of base_rules with the spec'd constants replaced by vector"""
+    rules = copy.deepcopy(base_rules)
+    for value, (path, *_) in zip(vector, spec):
+        target = rules
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = float(value)
+    return rules
+
+
+def make_objective(cases, loss='score'):
+    """
+    Objective over a CaseStore (lower is better).
+
+    'score' is the eval.sh formula (mean error * 100 + 0.1 per non-exact case),
+    'mae' the mean absolute error, 'mse' the mean squared error.
+    """
+    days = np.asarray(cases.days, dtype=np.float64)
+    miles = np.asarray(cases.miles)
+    receipts = np.asarray(cases.receipts)
+    expected = np.asarray(cases.expected)
+
+    def objective(rules):
+        try:
+            compiled = _rules.CompiledRules(rules)
+        except ValueError:
+            return np.inf  # e.g. tier bounds pushed out of order
+        errors = np.abs(calculate_reimbursement_batch(days, miles, receipts, rules=compiled) - expected)
+        if loss == 'mae':
+            return float(errors.mean())
+        if loss == 'mse':
+            return float((errors ** 2).mean())
+        return float(errors.mean() * 100 + np.count_nonzero(errors >= 0.01) * 0.1)
+
+    return objective
+
+
+def coordinate_descent(start, spec, base_rules, objective, max_rounds=200, min_step_fraction=1e-3):
+    """Greedy per-coordinate search with step halving; returns (best_value, best_vector)"""
+    lower = np.array([item[1] for item in spec])
+    upper = np.array([item[2] for item in spec])
+    steps = np.array([item[3] for item in spec])
+    min_steps = steps * min_step_fraction
+
+    x = np.clip(start, lower, upper)
+    best = objective(vector_to_rules(x, spec, base_rules))
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(len(x)):
+            for direction in (1.0, -1.0):
+                candidate = x.copy()
+                candidate[i] = min(max(candidate[i] + direction * steps[i], lower[i]), upper[i])
+                if candidate[i] == x[i]:
+                    continue
+                value = objective(vector_to_rules(candidate, spec, base_rules))
+                if value < best:
+                    x, best, improved = candidate, value, True
+                    break
+        if not improved:
+            steps = steps / 2
+            if np.all(steps < min_steps):
+                break
+    return best, x
+
+
+# Process-pool workers keep their own memory-mapped view of the cases
+_worker_state = {}
+
+
+def _init_worker(cases_path, loss):
+    _worker_state['objective'] = make_objective(case_store.load_cases(cases_path), loss)
+
+
+def _run_restart(args):
+    seed, start, spec, base_rules, perturbation, max_rounds = args
+    rng = np.random.default_rng(seed)
+    if seed:  # restart 0 starts from the given rules unperturbed
+        scale = np.array([item[3] for item in spec]) * perturbation
+        start = start + rng.uniform(-1.0, 1.0, size=len(start)) * scale
+    return coordinate_descent(start, spec, base_rules, _worker_state['objective'], max_rounds)
+
+
+def fit(cases_path='public_cases.json', base_rules=None, groups=PARAMETER_GROUPS, loss='score',
+        restarts=8, workers=None, perturbation=4.0, max_rounds=200):
+    """Fit base_rules to cases_path; returns (best_value, best_rules, start_value)"""
+    base_rules = copy.deepcopy(base_rules or _rules.V9_RULES)
+    spec = parameter_spec(base_rules, groups)
+    start = rules_to_vector(base_rules, spec)
+    workers = workers or os.cpu_count() or 1
+
+    _init_worker(cases_path, loss)
+    start_value = _worker_state['objective'](base_rules)
+    tasks = [(seed, start, spec, base_rules, perturbation, max_rounds) for seed in range(restarts)]
+
+    if workers <= 1:
+        outcomes = [_run_restart(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(cases_path, loss)) as pool:
+            outcomes = list(pool.map(_run_restart, tasks))
+
+    best_value, best_vector = min(outcomes, key=lambda outcome: outcome[0])
+    best_rules = vector_to_rules(best_vector, spec, base_rules)
+    best_rules['version'] = f"{base_rules.get('version', 'rules')}-fit"
+    best_rules['fit'] = {'cases': os.path.basename(cases_path), 'loss': loss, 'objective': best_value,
+                         'start_objective': start_value, 'restarts': restarts}
+    return best_value, best_rules, start_value
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit rule constants to historical cases")
+    parser.add_argument('--cases', default='public_cases.json', help="public-format case file")
+    parser.add_argument('--start', help="rules file to start from (default: built-in V9 rules)")
+    parser.add_argument('--groups', default=','.join(PARAMETER_GROUPS),
+                        help=f"comma-separated parameter groups ({', '.join(PARAMETER_GROUPS)})")
+    parser.add_argument('--loss', choices=('score', 'mae', 'mse'), default='score')
+    parser.add_argument('--restarts', type=int, default=8, help="independent searches (first is unperturbed)")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--max-rounds', type=int, default=200)
+    parser.add_argument('-o', '--output', default='rules/fitted.json', help="where to write the best rules")
+    args = parser.parse_args(argv)
+
+    groups = tuple(group.strip() for group in args.groups.split(',') if group.strip())
+    unknown = set(groups) - set(PARAMETER_GROUPS)
+    if unknown:
+        parser.error(f"unknown parameter groups: {', '.join(sorted(unknown))}")
+    base_rules = _rules.load_rules(args.start).source if args.start else None
+
+    best_value, best_rules, start_value = fit(args.cases, base_rules, groups, args.loss,
+                                              args.restarts, args.workers, max_rounds=args.max_rounds)
+    _rules.save_rules(best_rules, args.output)
+    print(f"{args.loss}: {start_value:.2f} -> {best_value:.2f}", file=sys.stderr)
+    print(f"Best rules written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+INTEGER-CENTS FIXED-POINT ENGINE
+The V9 rules evaluated in exact integer arithmetic.
+
+Units:
+- money in cents, miles in hundredths of a mile (inputs are rounded to these once)
+- rates in basis points (0.58 -> 5800), efficiency thresholds in hundredths of a mile per day
+- every component is summed exactly in 1/10000 of a cent (cents x basis points),
+  and the total is rounded to a cent once, by an explicit rule: round-half-even
+  (the default) or round-half-up
+
+Comparisons are exact too: "1800 <= receipts" compares cents with cents and
+"efficiency >= 100" compares miles x 100 with 100 x days x 100, so a claim sitting
+exactly on a boundary always lands on the same side on every machine.
+
+    calculate_reimbursement_cents(5, 250, 150.75)          # 89538 (int cents)
+    calculate_reimbursement_fixed(5, 250, 150.75)          # 895.38
+    calculate_reimbursement_fixed_batch(days, miles, receipts)
+
+Cross-check against the float engine:
+    python3 fixed_point.py [public_cases.json private_cases.json] [--fuzz 1000000] [--rounding half_up]
+"""
+
+import collections
+import sys
+from bisect import bisect_right
+
+import reimbursement_rules as _rules
+
+SUB = 10000  # 1/10000 cent units per cent (cents x basis points)
+ROUNDING_MODES = ('half_even', 'half_up')
+
+
+def _scaled(value, scale, what):
+    scaled = round(value * scale)
+    if abs(scaled - value * scale) > 1e-6 * max(1.0, abs(value * scale)):
+        raise ValueError(f"{what} {value!r} is not representable at 1/{scale}")
+    return int(scaled)
+
+
+def to_basis_points(rate):
+    return _scaled(rate, 10000, "rate")
+
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+class FixedRules:
+    """A compiled rule set converted to integer units"""
+
+    __slots__ = ('rules', 'per_diem', 'per_diem_default', 'per_diem_ladder', 'mileage_bp',
+                 'normal_bounds', 'normal_bp', 'penalty_bounds', 'penalty_bp', 'patterns',
+                 'patterns_by_day', 'five_day_bonus', 'five_day_bonus_reduced', 'long_trip_bonuses', 'minimum')
+
+    def __init__(self, rules):
+        rules = _rules.compile_rules(rules)
+        self.rules = rules
+        self.per_diem = {days: _scaled(rate, 100, "per diem") for days, rate in rules.per_diem.items()}
+        self.per_diem_default = _scaled(rules.per_diem_default, 100, "per diem")
+        self.per_diem_ladder = [_scaled(rate, 100, "per diem") for rate in rules.per_diem_ladder]
+        self.mileage_bp = to_basis_points(rules.mileage_rate)
+        self.normal_bounds = tuple(_scaled(bound, 100, "tier bound") for bound in rules.normal_bounds)
+        self.normal_bp = tuple(to_basis_points(rate) for rate in rules.normal_rates)
+        self.penalty_bounds = tuple(_scaled(bound, 100, "tier bound") for bound in rules.penalty_bounds)
+        self.penalty_bp = tuple(to_basis_points(rate) for rate in rules.penalty_rates)
+        # (index, days, min_eff, max_eff, min_receipts, max_receipts, reduces_bonus); efficiency in 1/100 mi/day
+        self.patterns = tuple(
+            (index, days,
+             None if min_eff is None else _scaled(min_eff, 100, "efficiency"),
+             None if max_eff is None else _scaled(max_eff, 100, "efficiency"),
+             _scaled(min_receipts, 100, "receipts"), _scaled(max_receipts, 100, "receipts"), reduces)
+            for index, days, min_eff, max_eff, min_receipts, max_receipts, reduces in rules.patterns
+        )
+        by_day = {}
+        for pattern in self.patterns:
+            by_day.setdefault(pattern[1], []).append(pattern)
+        self.patterns_by_day = {days: tuple(group) for days, group in by_day.items()}
+        self.five_day_bonus = _scaled(rules.five_day_bonus, 100, "bonus")
+        self.five_day_bonus_reduced = _scaled(rules.five_day_bonus_reduced, 100, "bonus")
+        self.long_trip_bonuses = tuple((min_days, _scaled(bonus, 100, "bonus"))
+                                       for min_days, bonus in rules.long_trip_bonuses)
+        self.minimum = _scaled(rules.minimum, 100, "minimum")
+
+
+# Bounded LRU of FixedRules. Compiled rule sets are keyed by id and kept alive while cached, so the
+# id cannot be reused under a live entry; rules dicts (a new object per call) are keyed by fingerprint.
+FIXED_CACHE_SIZE = 32
+_fixed_cache = collections.OrderedDict()
+
+
+def fixed_rules(rules=None):
+    rules = rules or _rules.ACTIVE_RULES
+    if isinstance(rules, _rules.CompiledRules):
+        key = ('id', id(rules))
+    else:
+        key = ('fingerprint', _rules.rules_fingerprint(rules))
+    cached = _fixed_cache.get(key)
+    if cached is None:
+        compiled = _rules.compile_rules(rules)
+        cached = _fixed_cache[key] = (compiled, FixedRules(compiled))
+        if len(_fixed_cache) > FIXED_CACHE_SIZE:
+            _fixed_cache.popitem(last=False)
+    else:
+        try:
+            _fixed_cache.move_to_end(key)
+        except KeyError:  # evicted by another thread in between; the entry we hold is still valid
+            pass
+    return cached[1]
+
+
+def round_sub_cents(total, rounding='half_even'):
+    """Round a 1/10000-cent amount to whole cents"""
+    cents, remainder = divmod(total, SUB)
+    if remainder * 2 > SUB or (remainder * 2 == SUB and (rounding == 'half_up' or cents % 2)):
+        cents += 1
+    return cents
+
+
+def calculate_reimbursement_cents(trip_duration_days, miles_traveled, total_receipts_amount, rules=None,
+                                  rounding='half_even'):
+    """V9 result in integer cents; days must be a whole number"""
+    fixed = fixed_rules(rules)
+    days = int(trip_duration_days)
+    if days != trip_duration_days:
+        raise ValueError("the fixed-point engine needs a whole number of days")
+    centimiles = to_cents(miles_traveled)
+    receipts = to_cents(total_receipts_amount)
+
+    # COMPONENT 1: Base Per Diem
+    total = days * fixed.per_diem.get(days, fixed.per_diem_default) * SUB
+
+    # COMPONENT 2: Mileage Reimbursement
+    total += centimiles * fixed.mileage_bp
+
+    # COMPONENT 3: Receipt Processing (efficiency compared as centimiles vs threshold x days)
+    eff_miles, eff_days = (centimiles, days) if days > 0 else (0, 1)
+    pattern = None
+    for candidate in fixed.patterns_by_day.get(days, ()):
+        _, _, min_eff, max_eff, min_receipts, max_receipts, _ = candidate
+        if ((min_eff is None or eff_miles >= min_eff * eff_days) and
+                (max_eff is None or eff_miles < max_eff * eff_days) and
+                min_receipts <= receipts <= max_receipts):
+            pattern = candidate
+            break
+    if receipts > 0:
+        if pattern is not None:
+            total += receipts * fixed.penalty_bp[bisect_right(fixed.penalty_bounds, receipts)]
+        else:
+            total += receipts * fixed.normal_bp[bisect_right(fixed.normal_bounds, receipts)]
+
+    # COMPONENT 4: Adjustments
+    if days == 5:
+        total += (fixed.five_day_bonus_reduced if pattern is not None and pattern[6]
+                  else fixed.five_day_bonus) * SUB
+    for min_days, bonus in fixed.long_trip_bonuses:
+        if days >= min_days:
+            total += bonus * SUB
+
+    return max(fixed.minimum, round_sub_cents(total, rounding))
+
+
+def calculate_reimbursement_fixed(trip_duration_days, miles_traveled, total_receipts_amount, rules=None,
+                                  rounding='half_even'):
+    """Fixed-point result in dollars (a float holding an exact cent value)"""
+    return calculate_reimbursement_cents(trip_duration_days, miles_traveled, total_receipts_amount,
+                                         rules, rounding) / 100
+
+
+def _exact_totals_batch(trip_duration_days, miles_traveled, total_receipts_amount, fixed):
+    """Unrounded, unfloored totals in 1/10000 cent as an int64 array"""
+    import numpy as np
+
+    days_in, miles_in, receipts_in = np.broadcast_arrays(
+        np.asarray(trip_duration_days, dtype=np.float64),
+        np.asarray(miles_traveled, dtype=np.float64),
+        np.asarray(total_receipts_amount, dtype=np.float64),
+    )
+    days = days_in.astype(np.int64)
+    if np.any(days != days_in):
+        raise ValueError("the fixed-point engine needs a whole number of days")
+    centimiles = np.rint(miles_in * 100).astype(np.int64)
+    receipts = np.rint(receipts_in * 100).astype(np.int64)
+
+    # COMPONENT 1: Base Per Diem (index 0 of the ladder holds the default rate)
+    ladder = np.asarray(fixed.per_diem_ladder, dtype=np.int64)
+    ladder_index = np.where((days >= 1) & (days < len(ladder)), days, 0)
+    total = days * ladder[ladder_index] * SUB
+
+    # COMPONENT 2: Mileage Reimbursement
+    total += centimiles * fixed.mileage_bp
+
+    # COMPONENT 3: Receipt Processing
+    eff_miles = np.where(days > 0, centimiles, 0)
+    eff_days = np.where(days > 0, days, 1)
+    pattern_index = np.full(days.shape, -1, dtype=np.intp)
+    for index, pattern_days, min_eff, max_eff, min_receipts, max_receipts, _ in fixed.patterns:
+        matched = (pattern_index < 0) & (days == pattern_days) & (receipts >= min_receipts) & (receipts <= max_receipts)
+        if min_eff is not None:
+            matched &= eff_miles >= min_eff * eff_days
+        if max_eff is not None:
+            matched &= eff_miles < max_eff * eff_days
+        pattern_index[matched] = index
+    penalised = pattern_index >= 0
+    penalty_bp = np.asarray(fixed.penalty_bp, dtype=np.int64)[
+        np.searchsorted(np.asarray(fixed.penalty_bounds, dtype=np.int64), receipts, side='right')]
+    normal_bp = np.asarray(fixed.normal_bp, dtype=np.int64)[
+        np.searchsorted(np.asarray(fixed.normal_bounds, dtype=np.int64), receipts, side='right')]
+    total += np.where(receipts > 0, receipts * np.where(penalised, penalty_bp, normal_bp), 0)
+
+    # COMPONENT 4: Adjustments
+    reduces_bonus = np.array([pattern[6] for pattern in fixed.patterns] + [False])
+    five_day = np.where(reduces_bonus[pattern_index], fixed.five_day_bonus_reduced, fixed.five_day_bonus)
+    total += np.where(days == 5, five_day, 0) * SUB
+    for min_days, bonus in fixed.long_trip_bonuses:
+        total += np.where(days >= min_days, bonus, 0) * SUB
+    return total
+
+
+def calculate_reimbursement_cents_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules=None,
+                                        rounding='half_even'):
+    """Vectorized calculate_reimbursement_cents; returns an int64 array"""
+    import numpy as np
+
+    fixed = fixed_rules(rules)
+    total = _exact_totals_batch(trip_duration_days, miles_traveled, total_receipts_amount, fixed)
+
+    # Explicit rounding to whole cents, then the floor
+    cents, remainder = np.divmod(total, SUB)
+    round_up = (remainder * 2 > SUB) | ((remainder * 2 == SUB) & ((cents % 2 == 1) | (rounding == 'half_up')))
+    return np.maximum(fixed.minimum, cents + round_up)
+
+
+def calculate_reimbursement_fixed_batch(trip_duration_days, miles_traveled, total_receipts_amount, rules=None,
+                                        rounding='half_even'):
+    """Vectorized fixed-point results in dollars (float64)"""
+    return calculate_reimbursement_cents_batch(trip_duration_days, miles_traveled, total_receipts_amount,
+                                               rules, rounding) / 100
+
+
+def cross_check(trip_duration_days, miles_traveled, total_receipts_amount, rules=None, rounding='half_even'):
+    """
+    Compare the fixed-point and float engines over arrays of claims.
+
+    Returns (indexes, float_results, fixed_results, half_cent_ties) for every
+    claim where the two disagree by at least a cent. half_cent_ties marks the
+    claims whose exact total sits on a half cent, where only the rounding rule
+    decides and binary floats round whichever way their representation error
+    happens to fall.
+    """
+    import numpy as np
+
+    from calculate_reimbursement import calculate_reimbursement_batch
+
+    float_cents = np.rint(np.asarray(calculate_reimbursement_batch(
+        trip_duration_days, miles_traveled, total_receipts_amount, rules=rules)) * 100).astype(np.int64).ravel()
+    fixed_cents = calculate_reimbursement_cents_batch(trip_duration_days, miles_traveled, total_receipts_amount,
+                                                      rules, rounding).ravel()
+    differ = np.flatnonzero(float_cents != fixed_cents)
+    exact = _exact_totals_batch(trip_duration_days, miles_traveled, total_receipts_amount,
+                                fixed_rules(rules)).ravel()[differ]
+    ties = exact % SUB * 2 == SUB
+    return differ, float_cents[differ] / 100, fixed_cents[differ] / 100, ties
+
+
+def main(argv=None):
+    import argparse
+
+    import numpy as np
+
+    import case_store
+
+    parser = argparse.ArgumentParser(description="Cross-check the fixed-point engine against the float engine")
+    parser.add_argument('cases', nargs='*', default=['public_cases.json', 'private_cases.json'])
+    parser.add_argument('--fuzz', type=int, default=0, help="also check N random claims at cent resolution")
+    parser.add_argument('--rounding', choices=ROUNDING_MODES, default='half_even')
+    parser.add_argument('--rules', help="rules file (default: the active rules)")
+    parser.add_argument('--show', type=int, default=10, help="differences to list per source")
+    args = parser.parse_args(argv)
+    rules = _rules.load_rules(args.rules) if args.rules else None
+
+    sources = []
+    for path in args.cases:
+        store = case_store.load_cases(path)
+        sources.append((path, np.asarray(store.days), np.asarray(store.miles), np.asarray(store.receipts)))
+    if args.fuzz:
+        rng = np.random.default_rng(0)
+        sources.append((f"{args.fuzz} fuzzed claims", rng.integers(1, 21, args.fuzz).astype(np.float64),
+                        rng.integers(0, 200000, args.fuzz) / 100, rng.integers(0, 300000, args.fuzz) / 100))
+
+    mismatched = 0
+    for name, days, miles, receipts in sources:
+        indexes, float_results, fixed_results, ties = cross_check(days, miles, receipts, rules, args.rounding)
+        mismatched += len(indexes) - int(ties.sum())
+        print(f"{name}: {len(indexes)} of {len(days)} claims differ "
+              f"({int(ties.sum())} on an exact half cent, {len(indexes) - int(ties.sum())} other)")
+        # Non-tie differences first: those are the ones that point at a real problem
+        order = np.argsort(ties, kind='stable')[:args.show]
+        for i, float_result, fixed_result, tie in zip(indexes[order], float_results[order], fixed_results[order],
+                                                      ties[order]):
+            print(f"  #{i + 1}: {days[i]:g} days, {miles[i]:g} miles, ${receipts[i]:.2f} receipts: "
+                  f"float ${float_result:.2f}, fixed ${fixed_result:.2f}{' (half-cent tie)' if tie else ''}")
+    # Ties are expected; any other difference means the engines disagree on the rules themselves
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
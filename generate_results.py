@@ -0,0 +1,136 @@
+"""
+STREAMING, RESUMABLE RESULTS GENERATOR
+Python replacement for generate_results.sh.
+
+- Streams private_cases.json one case at a time (memory stays flat however big the file is)
+- Writes results in buffered chunks, one line per case: the value exactly as run.sh
+  prints it, or ERROR when a case cannot be computed
+- After every chunk it records a checkpoint (cases done, output size, source offset),
+  so an interrupted run resumes where it stopped instead of starting over
+
+Usage:
+    python3 generate_results.py [private_cases.json] [-o private_results.txt]
+                                [--chunk-size N] [--restart]
+"""
+
+import json
+import os
+import sys
+
+from calculate_reimbursement import calculate_reimbursement
+from case_store import iter_cases
+
+
+def result_line(case, case_number=None, calculator=calculate_reimbursement):
+    """One output line for a case, as run.sh would print it (or ERROR)"""
+    try:
+        days = case['trip_duration_days']
+        if isinstance(days, float) and days.is_integer():
+            days = int(days)
+        days = int(str(days))
+        miles = float(case['miles_traveled'])
+        receipts = float(case['total_receipts_amount'])
+        return str(calculator(days, miles, receipts))
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Error on case {case_number}: Invalid input: {e!r}", file=sys.stderr)
+        return "ERROR"
+
+
+def _source_fingerprint(path):
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_checkpoint(checkpoint_path, source_path):
+    """Return the saved checkpoint if it belongs to the current source file, else None"""
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    fingerprint = _source_fingerprint(source_path)
+    if any(checkpoint.get(key) != value for key, value in fingerprint.items()):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """Atomically replace the checkpoint file"""
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def generate_results(cases_path='private_cases.json', output_path='private_results.txt',
+                     chunk_size=1000, restart=False, calculator=calculate_reimbursement):
+    """Stream cases_path into output_path, resuming from a checkpoint when possible"""
+    checkpoint_path = output_path + '.checkpoint'
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, cases_path)
+
+    if checkpoint and os.path.exists(output_path):
+        cases_done = checkpoint['cases_done']
+        source_offset = checkpoint['source_offset']
+        out = open(output_path, 'r+')
+        out.truncate(checkpoint['output_bytes'])  # drop any partially written chunk
+        out.seek(checkpoint['output_bytes'])
+        print(f"Resuming after {cases_done} cases...", file=sys.stderr)
+    else:
+        cases_done = 0
+        source_offset = 0
+        out = open(output_path, 'w')
+
+    checkpoint = _source_fingerprint(cases_path)
+    pending = []
+
+    def flush_chunk(offset):
+        out.write(''.join(pending))
+        out.flush()
+        os.fsync(out.fileno())
+        pending.clear()
+        checkpoint.update(cases_done=cases_done, source_offset=offset, output_bytes=out.tell())
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    with out:
+        for case, offset in iter_cases(cases_path, source_offset):
+            cases_done += 1
+            pending.append(result_line(case, cases_done, calculator) + '\n')
+            if len(pending) >= chunk_size:
+                flush_chunk(offset)
+                print(f"Progress: {cases_done} cases processed...", file=sys.stderr)
+        if pending:
+            flush_chunk(offset)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return cases_done
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate private_results.txt without forking run.sh")
+    parser.add_argument('cases', nargs='?', default='private_cases.json', help="private-format case file")
+    parser.add_argument('-o', '--output', default='private_results.txt', help="results file")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="cases per buffered write/checkpoint")
+    parser.add_argument('--restart', action='store_true', help="ignore any checkpoint and start over")
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help="memoize up to N distinct claims (0 = no cache)")
+    args = parser.parse_args(argv)
+
+    calculator = calculate_reimbursement
+    if args.cache_size:
+        from reimbursement_cache import ReimbursementCache
+
+        calculator = ReimbursementCache(args.cache_size)
+
+    total = generate_results(args.cases, args.output, args.chunk_size, args.restart, calculator)
+    print(f"✅ {total} results written to {args.output}", file=sys.stderr)
+    if args.cache_size:
+        print(f"Cache: {calculator.stats()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,9 +42,12 @@ echo "📊 Processing test cases and generating results..."
 echo "📝 Output will be saved to private_results.txt"
 echo
 
-# Extract all test data upfront in a single jq call for better performance
+# Extract all test data upfront in a single call for better performance
+# (the columnar case cache when available, otherwise a single jq pass)
 echo "Extracting test data..."
-test_data=$(jq -r '.[] | "\(.trip_duration_days):\(.miles_traveled):\(.total_receipts_amount)"' private_cases.json)
+if ! test_data=$(python3 case_store.py dump private_cases.json 2>/dev/null); then
+    test_data=$(jq -r '.[] | "\(.trip_duration_days):\(.miles_traveled):\(.total_receipts_amount)"' private_cases.json)
+fi
 
 # Convert to arrays for faster access (compatible with bash 3.2+)
 test_cases=()
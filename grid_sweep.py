@@ -0,0 +1,320 @@
+"""
+DENSE INPUT-SPACE SWEEP
+Map the cliffs of the rules by evaluating every point of a days x miles x receipts grid.
+
+The grid is cut into tiles of (all days) x (a block of miles) x (a block of
+receipt cents). Each tile is scored with the vectorized calculator (one extra
+mile row and receipt column of overlap, so differences across tile edges are
+not lost), written into a memory-mapped .npy result cube and reduced to small
+summaries before the next tile is touched. Tiles are spread over a process
+pool, so neither the grid nor the results ever have to fit in RAM.
+
+What gets reported:
+- cliffs: where the result jumps by more than any smooth slope allows. Along
+  receipts that is max(receipt rate) x step, along miles the mileage rate x step
+  (plus a cent for rounding); receipt cliffs are grouped by receipt amount,
+  mile cliffs by day count and mileage (the efficiency thresholds move with days)
+- non-monotonic regions: more receipts, miles or days paying at least a cent less,
+  per axis and day count with the range where it happens
+- the largest jumps along any axis
+
+Ranges are start:stop[:step] with stop included; receipts are in cents.
+
+Usage:
+    python3 grid_sweep.py [--days 1:14] [--miles 0:1500:5] [--receipt-cents 0:300000:100]
+                          [-o sweep.npy] [--workers N] [--tile-points 4000000] [--top 20] [--json]
+"""
+
+import heapq
+import json
+import os
+import sys
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement_batch
+import reimbursement_rules as _rules
+
+AXES = ('days', 'miles', 'receipts')
+
+
+def parse_range(text, kind=int):
+    """'start:stop[:step]' (stop inclusive) -> numpy array"""
+    parts = [kind(part) for part in text.split(':')]
+    if len(parts) == 1:
+        parts = [parts[0], parts[0]]
+    start, stop = parts[0], parts[1]
+    step = parts[2] if len(parts) > 2 else 1
+    if step <= 0 or stop < start:
+        raise ValueError(f"bad range {text!r}: need start <= stop and step > 0")
+    count = int((stop - start) // step) + 1
+    return start + np.arange(count, dtype=np.float64 if kind is float else np.int64) * step
+
+
+class SweepGrid:
+    """Axis values plus the tiling of the (miles, receipts) plane"""
+
+    def __init__(self, days, miles, receipt_cents, tile_points=4_000_000):
+        self.days = np.asarray(days, dtype=np.float64)
+        self.miles = np.asarray(miles, dtype=np.float64)
+        self.receipt_cents = np.asarray(receipt_cents, dtype=np.int64)
+        self.receipts = self.receipt_cents / 100
+        self.shape = (len(self.days), len(self.miles), len(self.receipts))
+        # Tiles span every day; the rest of the budget is split between miles rows and receipt columns
+        plane = max(tile_points // len(self.days), 1)
+        self.receipt_block = int(min(len(self.receipts), max(plane, 1)))
+        self.miles_block = int(min(len(self.miles), max(plane // self.receipt_block, 1)))
+
+    @property
+    def points(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def tiles(self):
+        for m0 in range(0, self.shape[1], self.miles_block):
+            for r0 in range(0, self.shape[2], self.receipt_block):
+                yield (m0, min(m0 + self.miles_block, self.shape[1]),
+                       r0, min(r0 + self.receipt_block, self.shape[2]))
+
+    def smooth_bounds(self, rules):
+        """Largest change a single step can make without a cliff, for the miles and receipts axes"""
+        miles_step = float(np.diff(self.miles).max()) if len(self.miles) > 1 else 0.0
+        receipt_step = float(np.diff(self.receipts).max()) if len(self.receipts) > 1 else 0.0
+        max_rate = max(rules.normal_rates + rules.penalty_rates)
+        return rules.mileage_rate * miles_step + 0.01, max_rate * receipt_step + 0.01
+
+    def value(self, axis, index):
+        return float((self.days, self.miles, self.receipts)[axis][index])
+
+
+def _group(keys, deltas, positions, values):
+    """
+    Per distinct key: (key, count, min value, max value, delta with the largest |delta|, its position).
+    keys and values are 1-D arrays parallel to deltas; positions an (n, 3) array of grid indexes.
+    """
+    # Largest |delta| first within a key, ties to the lowest grid position (tiling-independent)
+    order = np.lexsort((positions[:, 2], positions[:, 1], positions[:, 0], -np.abs(deltas), keys))
+    keys, deltas, positions, values = keys[order], deltas[order], positions[order], values[order]
+    unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    minimum = np.minimum.reduceat(values, first)
+    maximum = np.maximum.reduceat(values, first)
+    return [(int(key), int(count), low.item(), high.item(), float(deltas[i]), tuple(positions[i].tolist()))
+            for key, count, low, high, i in zip(unique, counts, minimum, maximum, first)]
+
+
+def _merge_group(table, key, count, low, high, worst, position):
+    entry = table.get(key)
+    if entry is None:
+        table[key] = [count, low, high, worst, position]
+        return
+    entry[0] += count
+    entry[1] = min(entry[1], low)
+    entry[2] = max(entry[2], high)
+    if (-abs(worst), position) < (-abs(entry[3]), entry[4]):
+        entry[3], entry[4] = worst, position
+
+
+def sweep_tile(grid, rules, tile, output=None, top=20):
+    """Score one tile, write it to output and return its summary"""
+    m0, m1, r0, r1 = tile
+    m_end = min(m1 + 1, grid.shape[1])  # one row / column of overlap with the next tile
+    r_end = min(r1 + 1, grid.shape[2])
+    days = grid.days[:, None, None]
+    miles = grid.miles[None, m0:m_end, None]
+    receipts = grid.receipts[None, None, r0:r_end]
+    results = calculate_reimbursement_batch(days, miles, receipts, rules=rules)
+    own = results[:, :m1 - m0, :r1 - r0]
+    if output is not None:
+        output[:, m0:m1, r0:r1] = own
+
+    miles_bound, receipt_bound = grid.smooth_bounds(rules)
+    offset = np.array([0, m0, r0])
+    summary = {'min': float(own.min()), 'max': float(own.max()), 'cliffs': {}, 'non_monotonic': {}, 'top': []}
+
+    diffs = (
+        # (axis, differences owned by this tile, smooth bound)
+        (0, np.diff(own, axis=0), None),
+        (1, np.diff(results[:, :, :r1 - r0], axis=1), miles_bound),
+        (2, np.diff(results[:, :m1 - m0, :], axis=2), receipt_bound),
+    )
+    for axis, delta, bound in diffs:
+        if not delta.size:
+            continue
+        if bound is not None:
+            where = np.nonzero(np.abs(delta) > bound)
+            if len(where[0]):
+                positions = np.column_stack(where) + offset
+                # Receipt cliffs sit at a receipt amount; mile cliffs at a (days, miles) pair
+                keys = positions[:, 2] if axis == 2 else positions[:, 0] * grid.shape[1] + positions[:, 1]
+                for key, *group in _group(keys, delta[where], positions, delta[where]):
+                    _merge_group(summary['cliffs'], (axis, key), *group)
+
+        # Drops are grouped by day count; min/max track where along the axis they happen
+        where = np.nonzero(delta <= -0.01)
+        if len(where[0]):
+            positions = np.column_stack(where) + offset
+            for key, *group in _group(positions[:, 0], delta[where], positions, positions[:, axis]):
+                _merge_group(summary['non_monotonic'], (axis, key), *group)
+
+        flat = np.abs(delta).ravel()
+        k = min(top, flat.size)
+        for i in np.argpartition(flat, flat.size - k)[flat.size - k:]:
+            index = np.array(np.unravel_index(i, delta.shape)) + offset
+            summary['top'].append((float(flat[i]), axis, tuple(index.tolist()), float(delta.flat[i])))
+    summary['top'] = heapq.nlargest(top, summary['top'])
+    return summary
+
+
+def _merge_summary(total, part, top):
+    total['min'] = min(total['min'], part['min'])
+    total['max'] = max(total['max'], part['max'])
+    for key, (count, low, high, worst, position) in part['cliffs'].items():
+        _merge_group(total['cliffs'], key, count, low, high, worst, position)
+    for key, (count, first, last, worst, position) in part['non_monotonic'].items():
+        _merge_group(total['non_monotonic'], key, count, first, last, worst, position)
+    total['top'] = heapq.nlargest(top, total['top'] + part['top'])
+
+
+# Process-pool workers open their own view of the grid and output file
+_worker_state = {}
+
+
+def _init_worker(grid, rules, output_path, top):
+    _worker_state.update(grid=grid, rules=_rules.compile_rules(rules), top=top,
+                         output=np.load(output_path, mmap_mode='r+') if output_path else None)
+
+
+def _run_tile(tile):
+    state = _worker_state
+    return sweep_tile(state['grid'], state['rules'], tile, state['output'], state['top'])
+
+
+def sweep(grid, rules=None, output_path=None, workers=1, top=20, progress=None):
+    """Sweep the whole grid; returns the report dict (see describe())"""
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    if output_path:
+        np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float64, shape=grid.shape).flush()
+    tiles = list(grid.tiles())
+    total = {'min': np.inf, 'max': -np.inf, 'cliffs': {}, 'non_monotonic': {}, 'top': []}
+
+    if workers <= 1:
+        _init_worker(grid, rules.source, output_path, top)
+        parts = map(_run_tile, tiles)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(grid, rules.source, output_path, top))
+        parts = pool.map(_run_tile, tiles)
+    try:
+        for done, part in enumerate(parts, 1):
+            _merge_summary(total, part, top)
+            if progress:
+                progress(done, len(tiles))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        _worker_state.pop('output', None)
+    return describe(grid, total)
+
+
+def describe(grid, total):
+    """Turn index-based summaries into a JSON-friendly report with axis values"""
+    def point(position):
+        d, m, r = position
+        return {'days': grid.value(0, d), 'miles': grid.value(1, m), 'receipts': grid.value(2, r)}
+
+    cliffs = []
+    for (axis, key), (count, low, high, worst, position) in total['cliffs'].items():
+        entry = {'axis': AXES[axis], 'lines': count, 'min_jump': round(low, 2), 'max_jump': round(high, 2),
+                 'largest_jump': round(worst, 2), 'at': point(position)}
+        if axis == 2:
+            entry['between'] = [grid.value(2, key), grid.value(2, key + 1)]
+        else:
+            d, m = divmod(key, grid.shape[1])
+            entry['days'] = grid.value(0, d)
+            entry['between'] = [grid.value(1, m), grid.value(1, m + 1)]
+        cliffs.append(entry)
+    cliffs.sort(key=lambda entry: (-entry['lines'], -abs(entry['largest_jump'])))
+
+    non_monotonic = []
+    for (axis, day), (count, first, last, worst, position) in sorted(total['non_monotonic'].items()):
+        non_monotonic.append({'axis': AXES[axis], 'days': grid.value(0, day), 'drops': count,
+                              'from': grid.value(axis, first), 'to': grid.value(axis, last + 1),
+                              'worst_drop': round(worst, 2), 'at': point(position)})
+
+    largest = [{'axis': AXES[axis], 'jump': round(delta, 2), 'at': point(position),
+                'to': grid.value(axis, position[axis] + 1)}
+               for _, axis, position, delta in total['top']]
+
+    return {
+        'shape': list(grid.shape),
+        'points': grid.points,
+        'result_range': [total['min'], total['max']],
+        'cliffs': cliffs,
+        'non_monotonic': non_monotonic,
+        'largest_jumps': largest,
+    }
+
+
+def print_report(report, limit=20):
+    print(f"Swept {report['points']:,} points {tuple(report['shape'])}; "
+          f"results ${report['result_range'][0]:.2f} - ${report['result_range'][1]:.2f}")
+
+    print(f"\nCLIFFS ({len(report['cliffs'])})")
+    for cliff in report['cliffs'][:limit]:
+        where = (f"receipts ${cliff['between'][0]:.2f} -> ${cliff['between'][1]:.2f}" if cliff['axis'] == 'receipts'
+                 else f"{cliff['days']:g} days, miles {cliff['between'][0]:g} -> {cliff['between'][1]:g}")
+        print(f"  {where}: {cliff['lines']} lines, jump {cliff['min_jump']:+.2f} .. {cliff['max_jump']:+.2f}")
+
+    print(f"\nNON-MONOTONIC REGIONS ({len(report['non_monotonic'])})")
+    for region in report['non_monotonic'][:limit]:
+        print(f"  more {region['axis']}, {region['days']:g} days: {region['drops']} drops between "
+              f"{region['from']:g} and {region['to']:g}, worst {region['worst_drop']:+.2f}")
+
+    print("\nLARGEST JUMPS")
+    for jump in report['largest_jumps'][:limit]:
+        at = jump['at']
+        print(f"  {jump['jump']:+10.2f}  {at['days']:g} days, {at['miles']:g} miles, ${at['receipts']:.2f} "
+              f"-> {jump['axis']} {jump['to']:g}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate the rules over a dense grid and map the cliffs")
+    parser.add_argument('--days', default='1:14', help="start:stop[:step], stop included")
+    parser.add_argument('--miles', default='0:1500:5')
+    parser.add_argument('--receipt-cents', default='0:300000:100')
+    parser.add_argument('--rules', help="rules file (default: the active rules)")
+    parser.add_argument('-o', '--output', help="memory-mapped .npy result cube (days, miles, receipts)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--tile-points', type=int, default=4_000_000, help="grid points per tile")
+    parser.add_argument('--top', type=int, default=20, help="largest jumps to keep / rows to print")
+    parser.add_argument('--json', action='store_true', help="emit the report as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        grid = SweepGrid(parse_range(args.days, float), parse_range(args.miles, float),
+                         parse_range(args.receipt_cents), args.tile_points)
+    except ValueError as error:
+        parser.error(str(error))
+    rules = _rules.load_rules(args.rules) if args.rules else None
+
+    def progress(done, total):
+        print(f"\r  {done}/{total} tiles", end='' if done < total else '\n', file=sys.stderr, flush=True)
+
+    report = sweep(grid, rules, args.output, args.workers, args.top, progress)
+    if args.output:
+        with open(os.path.splitext(args.output)[0] + '.json', 'w') as f:
+            json.dump({'axes': {'days': grid.days.tolist(), 'miles': grid.miles.tolist(),
+                                'receipt_cents': grid.receipt_cents.tolist()}, 'report': report}, f)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+INCREMENTAL RE-EVALUATION
+Only re-score the cases an edit can have affected, then show what moved.
+
+Every case's result is cached under a key built from:
+- the case inputs (days, miles, receipts)
+- the slice of the rule set that can touch a trip of that length: its per-diem
+  rate, the mileage rate, the receipt tiers, the penalty patterns for that day
+  count, the 5-day bonus (5-day trips only), the long-trip bonuses and the floor
+- a hash of the calculator source (calculate_reimbursement.py, reimbursement_rules.py)
+
+So editing the 5-day $1,800-$1,900 window in a rules file only recomputes 5-day
+trips; editing the code itself invalidates everything. After each run the
+results are compared with the previous run: which cases changed, by how much,
+and how the eval.sh score moved. --changelog appends one JSON line per run.
+
+Usage:
+    python3 incremental_eval.py [cases.json] [--rules rules.json] [--changelog runs.jsonl] [--top 10]
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from calculate_reimbursement import calculate_reimbursement_batch
+import case_store
+import evaluate
+import reimbursement_rules as _rules
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR_NAME = '.eval_cache'
+ENGINE_SOURCES = ('calculate_reimbursement.py', 'reimbursement_rules.py')
+
+
+def engine_fingerprint():
+    """Hash of the calculator source files"""
+    digest = hashlib.sha256()
+    for name in ENGINE_SOURCES:
+        with open(os.path.join(HERE, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def rules_slice(rules, days):
+    """The parts of a compiled rule set that can influence a trip of `days` days"""
+    source = rules.source
+    return {
+        'per_diem': rules.per_diem.get(days, rules.per_diem_default),
+        'mileage_rate': source['mileage_rate'],
+        'receipt_tiers': source['receipt_tiers'],
+        'penalty_patterns': [p for p in source['penalty_patterns'] if p['days'] == days],
+        'five_day_bonus': source['five_day_bonus'] if days == 5 else None,
+        'long_trip_bonuses': source['long_trip_bonuses'],
+        'minimum_reimbursement': source['minimum_reimbursement'],
+    }
+
+
+def case_keys(store, rules, engine):
+    """One cache key per case"""
+    rules = _rules.compile_rules(rules)
+    slice_hashes = {}
+    keys = []
+    for days, miles, receipts, *_ in store.rows():
+        if days not in slice_hashes:
+            canonical = json.dumps(rules_slice(rules, days), sort_keys=True)
+            slice_hashes[days] = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+        raw = f"{days}:{miles!r}:{receipts!r}:{slice_hashes[days]}:{engine}"
+        keys.append(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+    return keys
+
+
+def _cache_path(cases_path, cache_dir=None):
+    base = cache_dir or os.path.join(os.path.dirname(os.path.abspath(cases_path)), CACHE_DIR_NAME)
+    return os.path.join(base, os.path.basename(cases_path))
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'entries': {}, 'previous': None}
+
+
+def _save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def run(cases_path='public_cases.json', rules=None, cache_dir=None, top=10):
+    """
+    Score cases_path incrementally; returns a report dict with the recompute
+    counts, the changed cases (largest change first) and old/new summaries.
+    """
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    store = case_store.load_cases(cases_path)
+    keys = case_keys(store, rules, engine_fingerprint())
+
+    state_path = _cache_path(cases_path, cache_dir)
+    state = _load_state(state_path)
+    entries = state['entries']
+
+    missing = np.array([i for i, key in enumerate(keys) if key not in entries], dtype=np.intp)
+    if len(missing):
+        fresh = calculate_reimbursement_batch(store.days[missing], store.miles[missing],
+                                              store.receipts[missing], rules=rules)
+        for i, result in zip(missing.tolist(), fresh.tolist()):
+            entries[keys[i]] = result
+    results = [entries[key] for key in keys]
+
+    summary = None
+    if store.has_expected:
+        summary = evaluate.summarize(list(store.rows()), results)
+
+    previous = state.get('previous')
+    changes = []
+    if previous and len(previous['results']) == len(results):
+        expected = store.expected.tolist() if store.has_expected else None
+        for i, (old, new) in enumerate(zip(previous['results'], results)):
+            if old != new:
+                change = {'case': i + 1, 'old': old, 'new': new, 'delta': round(new - old, 2)}
+                if expected:
+                    change['old_error'] = round(abs(old - expected[i]), 2)
+                    change['new_error'] = round(abs(new - expected[i]), 2)
+                changes.append(change)
+        changes.sort(key=lambda change: abs(change['delta']), reverse=True)
+
+    # Keep this run's entries plus the previous run's, so undoing an edit is also instant
+    keep = set(keys) | set(previous['keys'] if previous else ())
+    state['entries'] = {key: value for key, value in entries.items() if key in keep}
+    state['previous'] = {'keys': keys, 'results': results,
+                         'summary': summary, 'rules': _rules.rules_fingerprint(rules)}
+    _save_state(state_path, state)
+
+    return {
+        'cases': len(results),
+        'recomputed': int(len(missing)),
+        'reused': len(results) - int(len(missing)),
+        'had_previous_run': previous is not None,
+        'changed': len(changes),
+        'top_changes': changes[:top],
+        'previous_summary': previous and previous.get('summary'),
+        'summary': summary,
+        'rules': _rules.rules_fingerprint(rules),
+    }
+
+
+def print_report(report):
+    print(f"Recomputed {report['recomputed']} of {report['cases']} cases ({report['reused']} reused)")
+    if not report['had_previous_run']:
+        print("No previous run to compare against.")
+    else:
+        print(f"Changed results: {report['changed']}")
+        for change in report['top_changes']:
+            line = (f"  Case {change['case']}: ${change['old']:.2f} -> ${change['new']:.2f} "
+                    f"({change['delta']:+.2f})")
+            if 'old_error' in change:
+                line += f", error ${change['old_error']:.2f} -> ${change['new_error']:.2f}"
+            print(line)
+    before, after = report['previous_summary'], report['summary']
+    if after:
+        if before:
+            print(f"Score: {before['score']:.2f} -> {after['score']:.2f} "
+                  f"({after['score'] - before['score']:+.2f}); exact matches "
+                  f"{before['exact_matches']} -> {after['exact_matches']}")
+        else:
+            print(f"Score: {after['score']:.2f}; exact matches {after['exact_matches']}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Incrementally re-score a case file and diff against the last run")
+    parser.add_argument('cases', nargs='?', default='public_cases.json')
+    parser.add_argument('--rules', help="rules file (default: the active rules)")
+    parser.add_argument('--top', type=int, default=10, help="how many changed cases to list")
+    parser.add_argument('--changelog', help="append a JSON line describing this run")
+    parser.add_argument('--json', action='store_true', help="emit the report as JSON")
+    args = parser.parse_args(argv)
+
+    rules = _rules.load_rules(args.rules) if args.rules else None
+    report = run(args.cases, rules, top=args.top)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+    if args.changelog:
+        entry = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'cases': os.path.basename(args.cases),
+            'rules': report['rules'],
+            'engine': engine_fingerprint(),
+            'recomputed': report['recomputed'],
+            'changed': report['changed'],
+            'score': report['summary'] and report['summary']['score'],
+            'top_changes': report['top_changes'],
+        }
+        with open(args.changelog, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+if __name__ == "__main__":
+    main()
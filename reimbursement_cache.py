@@ -0,0 +1,135 @@
+"""
+MEMOIZING RESULT CACHE
+Opt-in LRU cache in front of calculate_reimbursement for repeated claims.
+
+- Keyed on (days, miles in cents, receipts in cents) plus the fingerprint of the
+  rule set, so a cache never answers for a different set of rules
+- Inputs with sub-cent precision bypass the cache rather than being collapsed onto
+  a neighbouring key (the cached answer must equal the uncached one)
+- Bounded size with LRU eviction; hit, miss, bypass and eviction counters
+- save()/load() keep a warm cache across restarts
+- A single lock guards the table, so one cache can be shared by server threads
+
+    cache = ReimbursementCache(maxsize=100_000)
+    cache(5, 250, 150.75)
+    cache.stats()  # {'hits': ..., 'misses': ..., 'hit_rate': ...}
+"""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+
+from calculate_reimbursement import calculate_reimbursement
+import reimbursement_rules as _rules
+
+
+def _cache_key(trip_duration_days, miles_traveled, total_receipts_amount):
+    """(days, miles cents, receipts cents), or None when the inputs cannot be keyed exactly"""
+    try:
+        days = int(trip_duration_days)
+        miles_cents = round(miles_traveled * 100)
+        receipts_cents = round(total_receipts_amount * 100)
+    except (OverflowError, ValueError):
+        return None
+    if (days != trip_duration_days or miles_cents / 100 != miles_traveled or
+            receipts_cents / 100 != total_receipts_amount):
+        return None
+    return (days, miles_cents, receipts_cents)
+
+
+class ReimbursementCache:
+    """Thread-safe LRU cache around calculate_reimbursement"""
+
+    def __init__(self, maxsize=65536, rules=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+        self.fingerprint = _rules.rules_fingerprint(self.rules)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __call__(self, trip_duration_days, miles_traveled, total_receipts_amount):
+        key = _cache_key(trip_duration_days, miles_traveled, total_receipts_amount)
+        if key is None:
+            with self._lock:
+                self.bypasses += 1
+            return calculate_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount,
+                                           rules=self.rules)
+
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        # Compute outside the lock; a racing thread may compute the same key, which is harmless
+        result = calculate_reimbursement(trip_duration_days, miles_traveled, total_receipts_amount,
+                                         rules=self.rules)
+        with self._lock:
+            self.misses += 1
+            self._store(key, result)
+        return result
+
+    def _store(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counter snapshot"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self, path):
+        """Write the cache (least to most recently used) to a JSON file"""
+        with self._lock:
+            entries = [[days, miles, receipts, result]
+                       for (days, miles, receipts), result in self._entries.items()]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'rules': self.fingerprint, 'entries': entries}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Warm the cache from a file written by save().
+
+        Entries recorded under a different rule set are ignored. Returns the
+        number of entries loaded; a missing file loads nothing.
+        """
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if saved.get('rules') != self.fingerprint:
+            return 0
+        with self._lock:
+            for days, miles_cents, receipts_cents, result in saved['entries']:
+                self._store((days, miles_cents, receipts_cents), result)
+        return len(saved['entries'])
@@ -0,0 +1,160 @@
+"""
+ONE-SHOT CLAIM CLI
+The smallest start-up path for scoring claims in a fresh process.
+
+calculate_reimbursement.py also carries the test harness, the breakdown and
+batch paths and their imports; this entry point imports only sys and the rule
+engine (not os, argparse or json). A custom rule set can come precompiled as a
+.tables file (see reimbursement_rules.save_tables), which skips JSON parsing and
+table building; the built-in V9 rules are compiled from their literal on first
+use, which costs about as much as loading them would.
+
+Claims come as argv triples or, with no claims on the command line (or "-"),
+one per stdin line in the server's line protocol (tab- or space-separated).
+One result per line, exactly as calculate_reimbursement.py prints it; a bad
+claim prints "Error: Invalid arguments" (argv) or "ERROR Invalid arguments"
+(stdin) and the exit status is 1.
+
+Rules: --tables PATH, else REIMBURSEMENT_RULES, else the tables bundled in the
+zipapp this module was loaded from, else V9. --build writes that zipapp: bytecode only (no sources to
+compile at start-up) plus the compiled rule tables, runnable with `python3 -I -S`.
+Running a script always compiles it, and running an archive goes through
+runpy, so the quickest start is importing the module (what run.sh does), with
+the archive put on sys.path when shipping the zipapp.
+
+Usage:
+    python3 -S reimbursement_cli.py 5 250 150.75 [3 93 1.42 ...]
+    printf '5\\t250\\t150.75\\n' | python3 -S reimbursement_cli.py [--tables rules/x.tables]
+    python3 reimbursement_cli.py --build reimbursement.pyz [--rules rules/x.json]
+    python3 -I -S reimbursement.pyz 5 250 150.75
+    python3 -I -S -c "import sys; sys.path.insert(0, 'reimbursement.pyz'); import reimbursement_cli; reimbursement_cli.main()" ...
+"""
+
+import sys
+
+if __name__ == "__main__":
+    import os
+
+    # -I implies -P, which leaves the script's directory off sys.path; the rule engine lives next to us
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import reimbursement_rules as _rules
+
+BUNDLED_TABLES = 'rules.tables'
+USAGE = "usage: reimbursement_cli.py [--tables PATH] [<days> <miles> <receipts> ...]"
+
+
+def _bundled_rules():
+    """Tables built into the zipapp this module was imported from; None outside a zipapp"""
+    import zipimport  # frozen and already loaded, unlike os
+
+    if not isinstance(__loader__, zipimport.zipimporter):
+        return None
+    try:
+        data = __loader__.get_data(__loader__.prefix + BUNDLED_TABLES)
+    except OSError:
+        return None
+    return _rules.tables_from_bytes(data)
+
+
+def _score(rules, days, miles, receipts):
+    """Mirror of calculate_reimbursement.main's parsing; None when a field does not parse"""
+    try:
+        days = int(days)
+        miles = float(miles)
+        receipts = float(receipts)
+    except ValueError:
+        return None
+    return round(_rules.evaluate_claim(rules, days, miles, receipts)[-1], 2)
+
+
+def score_args(rules, args, out):
+    """Score argv triples; returns the number of claims that did not parse"""
+    failed = 0
+    for start in range(0, len(args), 3):
+        result = _score(rules, *args[start:start + 3])
+        if result is None:
+            failed += 1
+            out.write("Error: Invalid arguments\n")
+        else:
+            out.write(f"{result}\n")
+    return failed
+
+
+def score_lines(rules, lines, out):
+    """Score protocol lines (days, miles, receipts per line); blank lines are skipped"""
+    failed = 0
+    for line in lines:
+        line = line.strip('\r\n')
+        if not line.strip():
+            continue
+        fields = line.split('\t') if '\t' in line else line.split()
+        result = _score(rules, *fields) if len(fields) == 3 else None
+        if result is None:
+            failed += 1
+            out.write("ERROR Invalid arguments\n")
+        else:
+            out.write(f"{result}\n")
+    return failed
+
+
+def build_zipapp(output, rules=None):
+    """Write a zipapp of this CLI: compiled bytecode plus the rule set as precompiled tables"""
+    import os
+    import py_compile
+    import tempfile
+    import zipfile
+
+    rules = _rules.compile_rules(rules or _rules.ACTIVE_RULES)
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(output + '.tmp', 'w') as archive:
+        archive.writestr('__main__.py', "from reimbursement_cli import main\nmain()\n")
+        for module in ('reimbursement_cli', 'reimbursement_rules'):
+            # Unchecked-hash pyc with no source beside it: zipimport loads it as-is
+            compiled = py_compile.compile(os.path.join(source_dir, module + '.py'), os.path.join(tmp, module + '.pyc'),
+                                          doraise=True, optimize=2,
+                                          invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+            archive.write(compiled, module + '.pyc')
+        tables = os.path.join(tmp, BUNDLED_TABLES)
+        _rules.save_tables(rules, tables)
+        archive.write(tables, BUNDLED_TABLES)
+    os.replace(output + '.tmp', output)
+    os.chmod(output, 0o755)
+    return rules
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    if args[:1] == ['--build']:
+        if len(args) not in (2, 4) or (len(args) == 4 and args[2] != '--rules'):
+            sys.exit("usage: reimbursement_cli.py --build OUTPUT.pyz [--rules PATH]")
+        rules = build_zipapp(args[1], _rules.load_rules(args[3]) if len(args) == 4 else None)
+        print(f"✅ {args[1]} built with rules {rules.version}", file=sys.stderr)
+        return
+
+    try:
+        if args[:1] == ['--tables']:
+            if len(args) < 2:
+                sys.exit(USAGE)
+            rules = _rules.load_rules(args[1])
+            args = args[2:]
+        elif _rules.ACTIVE_RULES_PATH:
+            rules = _rules.ACTIVE_RULES
+        else:
+            rules = _bundled_rules() or _rules.DEFAULT_RULES
+    except (OSError, ValueError) as error:
+        print(f"❌ {error}", file=sys.stderr)
+        sys.exit(1)
+
+    if not args or args == ['-']:
+        failed = score_lines(rules, sys.stdin, sys.stdout)
+    elif len(args) % 3 == 0:
+        failed = score_args(rules, args, sys.stdout)
+    else:
+        sys.exit(USAGE)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+HTTP/JSON SCORING SERVICE
+asyncio HTTP/1.1 front end for the calculator, standard library + numpy only.
+
+ENDPOINTS:
+- POST /reimbursement  body: one claim or a JSON array of claims
+      {"trip_duration_days": 5, "miles_traveled": 250, "total_receipts_amount": 150.75}
+  reply: {"reimbursement": 895.38}, or for an array one {"reimbursement": ...} or
+  {"error": ...} per claim, in order. An invalid single claim gets a 400.
+- GET /metrics         request/claim/batch counters, latency percentiles, throughput
+- GET /health          {"status": "ok"}
+- GET /branches        rule-branch hit counters (--branch-counters); ?format=prometheus for text
+
+Single-claim requests are queued and coalesced: the batcher takes the first
+waiting claim, collects whatever else arrives within --window-ms (up to
+--max-batch claims) and scores them in one vectorized call. The queue holds at
+most --queue-size claims; beyond that requests are refused with 503 and a
+Retry-After header instead of piling up. Arrays are parsed and scored as their
+own batch on a worker thread, off the event loop; their claims count against
+--queue-size while in flight, so a backlog of arrays gets 503 too.
+
+Usage:
+    python3 reimbursement_http.py serve [--host 127.0.0.1] [--port 8080] [--window-ms 2]
+                                        [--max-batch 256] [--queue-size 4096] [--branch-counters]
+    python3 reimbursement_http.py loadtest [--port 8080] [--concurrency 64] [--requests 10000]
+"""
+
+import asyncio
+import collections
+import json
+import math
+import signal
+import sys
+import time
+
+from calculate_reimbursement import calculate_reimbursement_batch
+
+MAX_BODY = 8 << 20
+LARGE_BODY = 64 << 10  # bodies past this are decoded on a worker thread
+CLAIM_FIELDS = ('trip_duration_days', 'miles_traveled', 'total_receipts_amount')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_claim(claim):
+    """(days, miles, receipts) from a claim object; raises ValueError with a message"""
+    if not isinstance(claim, dict):
+        raise ValueError("claim must be a JSON object")
+    values = []
+    for field in CLAIM_FIELDS:
+        value = claim.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{field} must be a number")
+        try:
+            finite = math.isfinite(float(value))
+        except OverflowError:  # an int too large for a float
+            finite = False
+        if not finite:
+            raise ValueError(f"{field} must be finite")
+        values.append(value)
+    days, miles, receipts = values
+    if days != int(days):
+        raise ValueError("trip_duration_days must be a whole number")
+    return int(days), float(miles), float(receipts)
+
+
+class Metrics:
+    """Counters plus a rolling window of request latencies"""
+
+    def __init__(self, window=10000):
+        self.started = time.monotonic()
+        self.requests = collections.Counter()
+        self.claims = 0
+        self.batches = 0
+        self.batched_claims = 0
+        self.rejected = 0
+        self.latencies = collections.deque(maxlen=window)  # (finished_at, seconds, claims)
+
+    def observe(self, status, started, claims):
+        now = time.monotonic()
+        self.requests[status] += 1
+        self.claims += claims
+        self.latencies.append((now, now - started, claims))
+
+    def snapshot(self, queue_depth=0, recent_seconds=10.0):
+        now = time.monotonic()
+        latencies = sorted(seconds for _, seconds, _ in self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+
+        uptime = now - self.started
+        recent = sum(claims for finished, _, claims in self.latencies if finished >= now - recent_seconds)
+        return {
+            'uptime_seconds': round(uptime, 3),
+            'requests': sum(self.requests.values()),
+            'responses_by_status': {str(status): count for status, count in sorted(self.requests.items())},
+            'claims': self.claims,
+            'rejected': self.rejected,
+            'queue_depth': queue_depth,
+            'batches': self.batches,
+            'mean_batch_size': round(self.batched_claims / self.batches, 2) if self.batches else None,
+            'latency_ms': {'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                           'max': round(latencies[-1] * 1000, 3) if latencies else None},
+            'claims_per_second': round(self.claims / uptime, 2) if uptime > 0 else None,
+            'recent_claims_per_second': round(recent / min(recent_seconds, uptime), 2) if uptime > 0 else None,
+        }
+
+
+class MicroBatcher:
+    """Coalesces single claims into vectorized batches; the queue bound is the backpressure"""
+
+    def __init__(self, metrics, window=0.002, max_batch=256, queue_size=4096):
+        self.metrics = metrics
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.array_claims = 0  # claims of arrays being scored on worker threads
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def depth(self):
+        """Claims waiting or being scored outside a batch"""
+        return self.queue.qsize() + self.array_claims
+
+    def _refuse(self):
+        self.metrics.rejected += 1
+        return HTTPError(503, "server busy, retry shortly")
+
+    def submit(self, claim):
+        """Future for one parsed claim; raises HTTPError(503) when the queue is full"""
+        if self.depth() >= self.queue.maxsize:
+            raise self._refuse()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((claim, future))
+        except asyncio.QueueFull:
+            raise self._refuse()
+        return future
+
+    def admit(self, count):
+        """Reserve room for an array of count claims; raises HTTPError(503) when the queue is full
+
+        An array is admitted whenever there is room left, so one larger than the
+        whole bound still gets through on an otherwise idle server.
+        """
+        if self.depth() >= self.queue.maxsize:
+            raise self._refuse()
+        self.array_claims += count
+
+    def release(self, count):
+        self.array_claims -= count
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = score_claims([claim for claim, _ in batch])
+            except Exception as error:  # never leave a request hanging
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.metrics.batches += 1
+            self.metrics.batched_claims += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def _result_reply(result):
+    """Reply object for one scored claim; finite inputs can still overflow to infinity"""
+    if not math.isfinite(result):
+        return {'error': "claim is out of range"}
+    return {'reimbursement': result}
+
+
+def score_claims(claims):
+    """Results for a list of parsed (days, miles, receipts) claims, scored in one batch"""
+    days, miles, receipts = zip(*claims)
+    return calculate_reimbursement_batch(days, miles, receipts).tolist()
+
+
+def score_array(payload):
+    """One reply per claim object, in order; invalid claims get an error reply"""
+    replies = [None] * len(payload)
+    valid = []
+    for i, claim in enumerate(payload):
+        try:
+            valid.append((i, parse_claim(claim)))
+        except ValueError as error:
+            replies[i] = {'error': str(error)}
+    if valid:
+        for (i, _), result in zip(valid, score_claims([claim for _, claim in valid])):
+            replies[i] = _result_reply(result)
+    return replies
+
+
+class ScoringService:
+    def __init__(self, window=0.002, max_batch=256, queue_size=4096):
+        self.metrics = Metrics()
+        self.batcher = MicroBatcher(self.metrics, window, max_batch, queue_size)
+
+    async def handle(self, method, path, body):
+        """(status, payload, claims) for one request"""
+        path, _, query = path.partition('?')
+        if path == '/health':
+            return 200, {'status': 'ok'}, 0
+        if path == '/metrics':
+            return 200, self.metrics.snapshot(self.batcher.depth()), 0
+        if path == '/branches':
+            import branch_counters
+
+            counters = branch_counters.active()
+            if counters is None:
+                raise HTTPError(404, "branch counters are off; start with --branch-counters")
+            if query == 'format=prometheus':
+                return 200, branch_counters.to_prometheus(counters.snapshot()), 0
+            return 200, json.loads(branch_counters.to_json(counters.snapshot())), 0
+        if path != '/reimbursement':
+            raise HTTPError(404, f"no such endpoint: {path}")
+        if method != 'POST':
+            raise HTTPError(405, "use POST")
+        loop = asyncio.get_running_loop()
+        try:
+            if len(body) > LARGE_BODY:
+                payload = await loop.run_in_executor(None, json.loads, body)
+            else:
+                payload = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "body is not valid JSON")
+
+        if isinstance(payload, list):
+            self.batcher.admit(len(payload))
+            try:
+                replies = await loop.run_in_executor(None, score_array, payload)
+            finally:
+                self.batcher.release(len(payload))
+            return 200, replies, len(payload)
+
+        try:
+            claim = parse_claim(payload)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+        reply = _result_reply(await self.batcher.submit(claim))
+        if 'error' in reply:
+            raise HTTPError(400, reply['error'])
+        return 200, reply, 1
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body, keep_alive = request
+                started = time.monotonic()
+                claims = 0
+                extra_headers = {}
+                try:
+                    if isinstance(body, HTTPError):
+                        # The body was never read, so the stream cannot be reused
+                        keep_alive = False
+                        raise body
+                    status, payload, claims = await self.handle(method, path, body)
+                    response = _response(status, payload, keep_alive)
+                except HTTPError as error:
+                    status, payload = error.status, {'error': str(error)}
+                    if error.status == 503:
+                        extra_headers['Retry-After'] = '1'
+                    response = _response(status, payload, keep_alive, extra_headers)
+                except Exception as error:  # answer rather than drop the connection
+                    status, payload, keep_alive = 500, {'error': f"internal error: {error}"}, False
+                    response = _response(status, payload, keep_alive)
+                self.metrics.observe(status, started, claims)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080, ready=None):
+        """Run until cancelled; ready (a Future) receives the bound port"""
+        self.batcher.start()
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=MAX_BODY)
+        bound_port = server.sockets[0].getsockname()[1]
+        print(f"Reimbursement HTTP service listening on http://{host}:{bound_port}", file=sys.stderr)
+        if ready is not None:
+            ready.set_result(bound_port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+async def _read_request(reader):
+    """(method, path, headers, body, keep_alive), or None at end of stream; body may be an HTTPError"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, version = request_line.decode('latin-1').split()
+    except ValueError:
+        return 'GET', '', {}, HTTPError(400, "malformed request line"), False
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    body = b''
+    if 'transfer-encoding' in headers:
+        body = HTTPError(411, "chunked bodies are not supported; send Content-Length")
+    elif 'content-length' in headers:
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            body = HTTPError(400, "bad Content-Length")
+        elif length > MAX_BODY:
+            body = HTTPError(413, f"body larger than {MAX_BODY} bytes")
+        else:
+            body = await reader.readexactly(length)
+    return method, path, headers, body, keep_alive
+
+
+def _response(status, payload, keep_alive, extra_headers=None):
+    if isinstance(payload, str):  # Prometheus text exposition
+        body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload, allow_nan=False).encode('utf-8'), 'application/json'
+    headers = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+               f"Content-Type: {content_type}",
+               f"Content-Length: {len(body)}",
+               f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    headers += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+
+async def load_test(host='127.0.0.1', port=8080, concurrency=64, requests=10000, claim=None):
+    """Hammer POST /reimbursement over keep-alive connections; returns a summary dict"""
+    claim = claim or {'trip_duration_days': 5, 'miles_traveled': 250, 'total_receipts_amount': 150.75}
+    body = json.dumps(claim).encode('utf-8')
+    request = (f"POST /reimbursement HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+               f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body
+    remaining = [requests]
+    latencies = []
+    statuses = collections.Counter()
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - started)
+                statuses[int(status_line.split()[1])] += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'latency_ms': {name: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+                       for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+    }
+
+
+async def _serve_until_signalled(service, host, port):
+    task = asyncio.get_running_loop().create_task(service.serve(host, port))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HTTP/JSON reimbursement scoring service")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run the service")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--window-ms', type=float, default=2.0,
+                       help="how long the batcher waits for more claims after the first")
+    serve.add_argument('--max-batch', type=int, default=256, help="claims per vectorized batch")
+    serve.add_argument('--queue-size', type=int, default=4096,
+                       help="claims allowed to wait before requests get 503")
+    serve.add_argument('--branch-counters', action='store_true',
+                       help="count rule-branch hits and expose them at /branches")
+    loadtest = commands.add_parser('loadtest', help="drive a running service with concurrent requests")
+    loadtest.add_argument('--host', default='127.0.0.1')
+    loadtest.add_argument('--port', type=int, default=8080)
+    loadtest.add_argument('--concurrency', type=int, default=64, help="parallel keep-alive connections")
+    loadtest.add_argument('--requests', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.branch_counters:
+            import branch_counters
+
+            branch_counters.enable()
+        service = ScoringService(args.window_ms / 1000, args.max_batch, args.queue_size)
+        asyncio.run(_serve_until_signalled(service, args.host, args.port))
+    else:
+        summary = asyncio.run(load_test(args.host, args.port, args.concurrency, args.requests))
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
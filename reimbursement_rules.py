@@ -0,0 +1,309 @@
+"""
+TABLE-DRIVEN RULE ENGINE
+The V9 rules as data instead of if/elif chains.
+
+- Per-diem ladder: a lookup table indexed by day count (one probe, no branch walk)
+- Receipt tiers: sorted upper bounds searched with bisect
+- Problematic patterns: a predicate table, grouped by day count so only the
+  patterns for the trip's length are checked
+- One evaluation core (evaluate_claim) drives both calculate_reimbursement and
+  the component breakdown, so the two can no longer drift apart
+
+Rule sets are plain JSON-compatible dicts, so a versioned rules file
+(see rules/v9.json) can be loaded without editing code:
+
+    rules = load_rules('rules/v9.json')
+    calculate_reimbursement(5, 250, 150.75, rules=rules)
+
+Setting REIMBURSEMENT_RULES=<path> makes that file the active rule set.
+DEFAULT_RULES and ACTIVE_RULES are compiled on first use, so importing the
+engine builds nothing.
+
+A rule set can also be saved already compiled (save_tables, a marshal file
+ending in .tables): loading it skips the JSON parser and the table building,
+which is what the one-shot CLI (reimbursement_cli.py) wants at start-up.
+"""
+
+from bisect import bisect_right
+import sys
+
+# The hand-tuned V9 constants. Receipt tier bounds are exclusive upper bounds:
+# a receipt total below bounds[i] (and not below bounds[i-1]) uses rates[i];
+# anything at or above the last bound uses rates[-1].
+V9_RULES = {
+    'version': 'V9',
+    'per_diem': {
+        'by_days': [96, 105, 108, 90, 75, 70, 65, 60, 55, 50, 45, 40, 35, 30],  # days 1..14
+        'default': 25,
+    },
+    'mileage_rate': 0.58,
+    'receipt_tiers': {
+        'normal': {'bounds': [10, 100, 500, 1000, 2000], 'rates': [1.0, 0.3, 0.5, 0.7, 0.5, 0.3]},
+        'penalty': {'bounds': [100, 500, 1000], 'rates': [0.3, 0.2, 0.1, 0.05]},
+    },
+    # Checked in order, first match wins. Efficiency bounds: min inclusive, max exclusive.
+    'penalty_patterns': [
+        {'name': 'five_day_high_efficiency', 'days': 5, 'min_efficiency': 100, 'max_efficiency': None,
+         'min_receipts': 1800, 'max_receipts': 1900, 'reduces_five_day_bonus': True},
+        {'name': 'one_day_extreme_efficiency', 'days': 1, 'min_efficiency': 1000, 'max_efficiency': None,
+         'min_receipts': 1800, 'max_receipts': 1850, 'reduces_five_day_bonus': False},
+        {'name': 'eight_day_high_efficiency', 'days': 8, 'min_efficiency': 90, 'max_efficiency': None,
+         'min_receipts': 1600, 'max_receipts': 1700, 'reduces_five_day_bonus': False},
+        {'name': 'five_day_low_efficiency', 'days': 5, 'min_efficiency': None, 'max_efficiency': 40,
+         'min_receipts': 1200, 'max_receipts': 1300, 'reduces_five_day_bonus': True},
+    ],
+    'five_day_bonus': {'normal': 300, 'reduced': 50},
+    'long_trip_bonuses': [[10, 200], [14, 400]],  # [min_days, bonus], cumulative
+    'minimum_reimbursement': 50,
+}
+
+
+def tier_labels(bounds):
+    """Labels for the tiers cut by bounds: ['<10', '<100', ..., '>=2000']"""
+    return [f'<{bound:g}' for bound in bounds] + [f'>={bounds[-1]:g}' if bounds else 'all']
+
+
+class CompiledRules:
+    """A rule set flattened into the lookup structures the hot path needs"""
+
+    __slots__ = ('version', 'source', 'per_diem', 'per_diem_default', 'per_diem_ladder',
+                 'mileage_rate', 'normal_bounds', 'normal_rates', 'normal_tier_labels',
+                 'penalty_bounds', 'penalty_rates', 'penalty_tier_labels', 'patterns',
+                 'patterns_by_day', 'five_day_bonus', 'five_day_bonus_reduced',
+                 'long_trip_bonuses', 'minimum')
+
+    def __init__(self, rules):
+        self.source = rules
+        self.version = rules.get('version', 'unversioned')
+
+        ladder = rules['per_diem']['by_days']
+        self.per_diem_default = rules['per_diem']['default']
+        # Dict keyed by day count: equality lookup, so 5 and 5.0 behave the same as ==
+        self.per_diem = {days: rate for days, rate in enumerate(ladder, start=1)}
+        # Index 0 holds the default; used by the vectorized path
+        self.per_diem_ladder = [self.per_diem_default] + list(ladder)
+
+        self.mileage_rate = rules['mileage_rate']
+
+        tiers = rules['receipt_tiers']
+        self.normal_bounds = tuple(tiers['normal']['bounds'])
+        self.normal_rates = tuple(tiers['normal']['rates'])
+        self.penalty_bounds = tuple(tiers['penalty']['bounds'])
+        self.penalty_rates = tuple(tiers['penalty']['rates'])
+        for bounds, rates in ((self.normal_bounds, self.normal_rates),
+                              (self.penalty_bounds, self.penalty_rates)):
+            if len(rates) != len(bounds) + 1 or list(bounds) != sorted(bounds):
+                raise ValueError("receipt tiers need sorted bounds and len(bounds) + 1 rates")
+        self.normal_tier_labels = tuple('normal ' + label for label in tier_labels(self.normal_bounds))
+        self.penalty_tier_labels = tuple('penalty ' + label for label in tier_labels(self.penalty_bounds))
+
+        # (index, days, min_eff, max_eff, min_receipts, max_receipts, reduces_bonus)
+        self.patterns = tuple(
+            (i, p['days'], p.get('min_efficiency'), p.get('max_efficiency'),
+             p['min_receipts'], p['max_receipts'], bool(p.get('reduces_five_day_bonus')))
+            for i, p in enumerate(rules['penalty_patterns'])
+        )
+        by_day = {}
+        for pattern in self.patterns:
+            by_day.setdefault(pattern[1], []).append(pattern)
+        self.patterns_by_day = {days: tuple(group) for days, group in by_day.items()}
+
+        self.five_day_bonus = rules['five_day_bonus']['normal']
+        self.five_day_bonus_reduced = rules['five_day_bonus']['reduced']
+        self.long_trip_bonuses = tuple((min_days, bonus) for min_days, bonus in rules['long_trip_bonuses'])
+        self.minimum = rules['minimum_reimbursement']
+
+    def pattern_name(self, index):
+        """Human-readable name of a penalty pattern index (None when no pattern fired)"""
+        if index is None:
+            return None
+        return self.source['penalty_patterns'][index].get('name', f"pattern_{index + 1}")
+
+
+def compile_rules(rules):
+    """Compile a rules dict (or pass an already compiled rule set through)"""
+    return rules if isinstance(rules, CompiledRules) else CompiledRules(rules)
+
+
+def load_rules(path):
+    """Load and compile a JSON rules file (or load a precompiled .tables file)"""
+    import json
+
+    if path.endswith(TABLES_SUFFIX):
+        return load_tables(path)
+    with open(path, 'r') as f:
+        return CompiledRules(json.load(f))
+
+
+def save_rules(rules, path):
+    """Write a rules dict (or compiled rule set) as a JSON rules file"""
+    import json
+
+    if isinstance(rules, CompiledRules):
+        rules = rules.source
+    with open(path, 'w') as f:
+        json.dump(rules, f, indent=2)
+        f.write('\n')
+
+
+# Precompiled tables: the CompiledRules slots as a marshal blob (marshal is built in, so no imports)
+TABLES_SUFFIX = '.tables'
+TABLES_FORMAT = 1
+
+
+def save_tables(rules, path):
+    """Write a rule set, compiled, as a .tables file"""
+    import marshal
+
+    rules = compile_rules(rules)
+    state = {name: getattr(rules, name) for name in CompiledRules.__slots__}
+    with open(path, 'wb') as f:
+        marshal.dump((TABLES_FORMAT, state), f)
+
+
+def tables_from_bytes(data):
+    """A CompiledRules rebuilt from the contents of a .tables file"""
+    import marshal
+
+    try:
+        tables_format, state = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        raise ValueError("not a rule tables file") from None
+    if tables_format != TABLES_FORMAT or set(state) != set(CompiledRules.__slots__):
+        raise ValueError(f"rule tables format {tables_format!r} is not supported; recompile the tables")
+    rules = CompiledRules.__new__(CompiledRules)
+    for name, value in state.items():
+        setattr(rules, name, value)
+    return rules
+
+
+def load_tables(path):
+    """Load a .tables file written by save_tables"""
+    with open(path, 'rb') as f:
+        return tables_from_bytes(f.read())
+
+
+def rules_fingerprint(rules):
+    """Stable content hash of a rule set, for keying caches on the active rules"""
+    import hashlib
+    import json
+
+    if isinstance(rules, CompiledRules):
+        rules = rules.source
+    canonical = json.dumps(rules, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def match_pattern(rules, trip_duration_days, efficiency, total_receipts_amount):
+    """Index of the first penalty pattern that matches, or None"""
+    for index, days, min_eff, max_eff, min_receipts, max_receipts, _ in rules.patterns_by_day.get(
+            trip_duration_days, ()):
+        if ((min_eff is None or efficiency >= min_eff) and
+                (max_eff is None or efficiency < max_eff) and
+                min_receipts <= total_receipts_amount <= max_receipts):
+            return index
+    return None
+
+
+def evaluate_claim(rules, trip_duration_days, miles_traveled, total_receipts_amount):
+    """
+    Single evaluation core shared by the numeric and breakdown paths.
+
+    Returns a plain tuple (cheap to build on the hot path):
+    (base_per_day, base_amount, mileage_amount, efficiency, pattern_index,
+     receipt_tier, receipt_rate, receipt_component, adjustment, total_before_floor, total)
+    receipt_tier indexes the penalty tiers when a pattern fired, the normal tiers
+    otherwise, and is None when there are no receipts.
+    The summation order matches the original V9 code exactly.
+    """
+    # COMPONENT 1: Base Per Diem
+    base_per_day = rules.per_diem.get(trip_duration_days, rules.per_diem_default)
+    base_amount = trip_duration_days * base_per_day
+
+    # COMPONENT 2: Mileage Reimbursement
+    mileage_amount = miles_traveled * rules.mileage_rate
+
+    # COMPONENT 3: Receipt Processing
+    efficiency = miles_traveled / trip_duration_days if trip_duration_days > 0 else 0
+    pattern_index = None
+    if trip_duration_days in rules.patterns_by_day:
+        pattern_index = match_pattern(rules, trip_duration_days, efficiency, total_receipts_amount)
+
+    receipt_tier = None
+    rate = 0
+    receipt_component = 0
+    if total_receipts_amount > 0:
+        if pattern_index is not None:
+            receipt_tier = bisect_right(rules.penalty_bounds, total_receipts_amount)
+            rate = rules.penalty_rates[receipt_tier]
+        else:
+            receipt_tier = bisect_right(rules.normal_bounds, total_receipts_amount)
+            rate = rules.normal_rates[receipt_tier]
+        receipt_component = total_receipts_amount * rate
+
+    # COMPONENT 4: Adjustments
+    adjustment = 0
+    if trip_duration_days == 5:
+        if pattern_index is not None and rules.patterns[pattern_index][6]:
+            adjustment = rules.five_day_bonus_reduced
+        else:
+            adjustment = rules.five_day_bonus
+    for min_days, bonus in rules.long_trip_bonuses:
+        if trip_duration_days >= min_days:
+            adjustment += bonus
+
+    total_before_floor = base_amount + mileage_amount + receipt_component + adjustment
+    total = max(rules.minimum, total_before_floor)
+
+    return (base_per_day, base_amount, mileage_amount, efficiency, pattern_index,
+            receipt_tier, rate, receipt_component, adjustment, total_before_floor, total)
+
+
+def _environment_rules_path():
+    """REIMBURSEMENT_RULES; read from posix.environ when os (and its _collections_abc) is not loaded yet"""
+    if 'os' in sys.modules or sys.platform == 'win32':
+        import os
+
+        return os.environ.get('REIMBURSEMENT_RULES') or None
+    import posix
+
+    path = posix.environ.get(b'REIMBURSEMENT_RULES')
+    return path.decode(sys.getfilesystemencoding(), 'surrogateescape') if path else None
+
+
+# The rules file REIMBURSEMENT_RULES selects (None: V9), read at import like before
+ACTIVE_RULES_PATH = _environment_rules_path()
+
+
+def __getattr__(name):
+    """DEFAULT_RULES and ACTIVE_RULES, compiled on first access"""
+    if name == 'DEFAULT_RULES':
+        value = CompiledRules(V9_RULES)
+    elif name == 'ACTIVE_RULES':
+        if ACTIVE_RULES_PATH:
+            value = load_rules(ACTIVE_RULES_PATH)
+        else:
+            value = globals().get('DEFAULT_RULES') or __getattr__('DEFAULT_RULES')
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # setdefault: a racing first access still leaves everyone holding the same object
+    return globals().setdefault(name, value)
+
+
+def set_active_rules(rules):
+    """Swap the rule set used when callers do not pass rules explicitly"""
+    global ACTIVE_RULES
+    ACTIVE_RULES = compile_rules(rules)
+    return ACTIVE_RULES
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python3 reimbursement_rules.py <path>  - export the built-in V9 rules (.tables: precompiled)
+    # python3 reimbursement_rules.py <rules.json> <out.tables>  - precompile a rules file
+    if len(sys.argv) > 2:
+        save_tables(load_rules(sys.argv[1]), sys.argv[2])
+    else:
+        path = sys.argv[1] if len(sys.argv) > 1 else 'rules/v9.json'
+        (save_tables if path.endswith(TABLES_SUFFIX) else save_rules)(V9_RULES, path)
@@ -0,0 +1,220 @@
+"""
+PERSISTENT REIMBURSEMENT SERVER
+Keeps one interpreter alive so run.sh does not pay Python start-up per claim.
+
+PROTOCOL (one request per line, one reply per line):
+- Request:  "<days>\t<miles>\t<receipts>\n"  (whitespace-separated also accepted)
+- Reply:    "<result>\n"  exactly as `python3 calculate_reimbursement.py` prints it,
+            or "ERROR <message>\n" when the arguments do not parse
+- "STATS" returns the calculator's counters as one JSON line (--cache-size, --lookup, --residual-model)
+- "BRANCHES" returns the rule-branch hit counters as one JSON line (--branch-counters)
+
+TRANSPORTS:
+- TCP on 127.0.0.1 (default) - the port is written to .reimbursement_server.port so
+  run.sh can reach it through bash's /dev/tcp without forking anything
+- Unix socket (--socket PATH) for local Python clients
+- stdin/stdout (--stdio) for pipelines and co-processes
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+from calculate_reimbursement import calculate_reimbursement
+
+DEFAULT_PORT_FILE = '.reimbursement_server.port'
+
+
+def handle_request_line(line, calculator=calculate_reimbursement):
+    """Answer one protocol line; mirrors the argument parsing in main()"""
+    line = line.strip('\r\n')
+    if line == 'STATS':
+        stats = calculator.stats() if hasattr(calculator, 'stats') else {}
+        return json.dumps(stats)
+    if line == 'BRANCHES':
+        import branch_counters
+
+        counters = branch_counters.active()
+        return branch_counters.to_json(counters.snapshot() if counters else {}, indent=None)
+    fields = line.split('\t') if '\t' in line else line.split()
+    if len(fields) != 3:
+        return "ERROR Invalid arguments"
+    try:
+        days = int(fields[0])
+        miles = float(fields[1])
+        receipts = float(fields[2])
+    except ValueError:
+        return "ERROR Invalid arguments"
+    return str(calculator(days, miles, receipts))
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    """Serve request lines on one connection until the client hangs up"""
+
+    def handle(self):
+        for raw in self.rfile:
+            reply = handle_request_line(raw.decode('utf-8', 'replace'), self.server.calculator)
+            self.wfile.write(reply.encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    calculator = staticmethod(calculate_reimbursement)
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    calculator = staticmethod(calculate_reimbursement)
+
+
+def serve_stdio(instream=None, outstream=None, calculator=calculate_reimbursement):
+    """Line protocol over stdin/stdout"""
+    instream = instream or sys.stdin
+    outstream = outstream or sys.stdout
+    for line in instream:
+        outstream.write(handle_request_line(line, calculator) + '\n')
+        outstream.flush()
+
+
+def serve_tcp(port=0, port_file=DEFAULT_PORT_FILE, calculator=calculate_reimbursement):
+    """Serve on 127.0.0.1 and advertise the bound port in port_file"""
+    with _TCPServer(('127.0.0.1', port), _LineHandler) as server:
+        server.calculator = calculator
+        bound_port = server.server_address[1]
+        if port_file:
+            with open(port_file, 'w') as f:
+                f.write(f"{bound_port}\n")
+        print(f"Reimbursement server listening on 127.0.0.1:{bound_port}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if port_file and os.path.exists(port_file):
+                os.remove(port_file)
+
+
+def serve_unix(path, calculator=calculate_reimbursement):
+    """Serve on a Unix domain socket at path"""
+    if os.path.exists(path):
+        os.remove(path)
+    with _UnixServer(path, _LineHandler) as server:
+        server.calculator = calculator
+        print(f"Reimbursement server listening on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def request(trip_duration_days, miles_traveled, total_receipts_amount,
+            address=None, timeout=5.0):
+    """
+    Thin Python client: ask a running server, fall back to in-process calculation.
+
+    address is a Unix socket path, a TCP port number, or None to use the
+    advertised port file. Returns the reply line as printed by the CLI.
+    """
+    line = f"{trip_duration_days}\t{miles_traveled}\t{total_receipts_amount}\n"
+    try:
+        if address is None:
+            with open(DEFAULT_PORT_FILE) as f:
+                address = int(f.read().strip())
+        if isinstance(address, int):
+            sock = socket.create_connection(('127.0.0.1', address), timeout=timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(address)
+        with sock, sock.makefile('rwb') as stream:
+            stream.write(line.encode('utf-8'))
+            stream.flush()
+            reply = stream.readline().decode('utf-8').strip()
+        if reply:
+            return reply
+    except (OSError, ValueError):
+        pass
+    return handle_request_line(line)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Turn SIGTERM into a normal exit so the port file / socket get cleaned up
+    sys.exit(0)
+
+
+def main(argv=None):
+    """Entry point for `python3 calculate_reimbursement.py --serve [...]`"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Persistent reimbursement calculator server")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument('--stdio', action='store_true', help="line protocol on stdin/stdout")
+    transport.add_argument('--socket', metavar='PATH', help="listen on a Unix domain socket")
+    transport.add_argument('--port', type=int, default=0, help="TCP port on 127.0.0.1 (0 = any free port)")
+    parser.add_argument('--port-file', default=DEFAULT_PORT_FILE,
+                        help="where to advertise the TCP port for run.sh")
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help="memoize up to N distinct claims (0 = no cache)")
+    parser.add_argument('--cache-file', help="load the cache at start-up and save it on exit")
+    parser.add_argument('--lookup', metavar='CASES',
+                        help="answer known claims from this public-format case file and correct the "
+                             "rest by their nearest neighbours")
+    parser.add_argument('--lookup-k', type=int, default=5, help="neighbours per correction (--lookup)")
+    parser.add_argument('--lookup-max-distance', type=float,
+                        help="ignore neighbours farther than this in scaled units (--lookup)")
+    parser.add_argument('--residual-model', metavar='MODEL',
+                        help="add a trained residual correction (see residual_model.py) to every result")
+    parser.add_argument('--branch-counters', action='store_true',
+                        help="count rule-branch hits (query with BRANCHES)")
+    args = parser.parse_args(argv)
+    if sum(map(bool, (args.cache_size, args.lookup, args.residual_model))) > 1:
+        parser.error("--cache-size, --lookup and --residual-model cannot be combined")
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+    if args.branch_counters:
+        import branch_counters
+
+        branch_counters.enable()
+
+    calculator = calculate_reimbursement
+    if args.cache_size:
+        from reimbursement_cache import ReimbursementCache
+
+        calculator = ReimbursementCache(args.cache_size)
+        if args.cache_file:
+            calculator.load(args.cache_file)
+    elif args.lookup:
+        from case_index import CaseIndex, NeighborCalculator
+
+        calculator = NeighborCalculator(CaseIndex.from_file(args.lookup), args.lookup_k,
+                                        args.lookup_max_distance)
+    elif args.residual_model:
+        from residual_model import ResidualCalculator, ResidualModel
+
+        try:
+            calculator = ResidualCalculator(ResidualModel.load(args.residual_model))
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+
+    try:
+        if args.stdio:
+            serve_stdio(calculator=calculator)
+        elif args.socket:
+            serve_unix(args.socket, calculator)
+        else:
+            serve_tcp(args.port, args.port_file, calculator)
+    finally:
+        if args.cache_size and args.cache_file:
+            calculator.save(args.cache_file)
+
+
+if __name__ == "__main__":
+    main()
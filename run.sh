@@ -6,5 +6,32 @@
 # echo "TODO: Implement your reimbursement calculation here"
 # echo "Input: $1 days, $2 miles, \$$3 receipts"
 # echo "Output should be a single number (the reimbursement amount)" 
-# Python implementation calling your calculate_reimbursement.py
-python3 calculate_reimbursement.py "$1" "$2" "$3" 
\ No newline at end of file
+
+# Fast path: hand the claim to a running server (python3 calculate_reimbursement.py --serve)
+# over bash's built-in /dev/tcp, so no interpreter is started per claim.
+PORT_FILE="${REIMBURSEMENT_SERVER_PORT_FILE:-.reimbursement_server.port}"
+port="$REIMBURSEMENT_SERVER_PORT"
+if [ -z "$port" ] && [ -r "$PORT_FILE" ]; then
+    read -r port < "$PORT_FILE"
+fi
+if [ -n "$port" ]; then
+    reply=""
+    {
+        printf '%s\t%s\t%s\n' "$1" "$2" "$3" >&3
+        IFS= read -r -t 5 reply <&3
+    } 2>/dev/null 3<>"/dev/tcp/127.0.0.1/$port"
+    case "$reply" in
+        "ERROR "*)
+            echo "Error: ${reply#ERROR }"
+            exit 1
+            ;;
+        ?*)
+            echo "$reply"
+            exit 0
+            ;;
+    esac
+fi
+
+# Python implementation: the minimal one-shot CLI (reimbursement_cli.py) without site-packages,
+# imported rather than run as a script so its cached bytecode is used
+python3 -S -c 'import reimbursement_cli; reimbursement_cli.main()' "$1" "$2" "$3" 
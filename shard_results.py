@@ -0,0 +1,325 @@
+"""
+SHARDED RESULTS GENERATION
+generate_results.py split into index-range shards that run in parallel, on one
+machine or several sharing a directory, then merge back into one file.
+
+Work directory layout (any shared filesystem works):
+    plan.json                  source file, its size and mtime, the rules fingerprint, the plan id,
+                               and each shard's first case, case count and byte offset
+    shard-<plan>-00003.lock    claimed by a worker (host, pid, time); created with O_EXCL
+    shard-<plan>-00003.txt     finished output, one line per case (value or ERROR), renamed into place
+    shard-<plan>-00003.error   why the last attempt failed
+
+The plan id hashes the source's size and mtime, the shard size and the active
+rules, and every shard file carries it: output from an older plan (a changed
+source, other rules) never counts as done. Re-planning deletes it.
+
+Commands:
+    plan    scan the source once and cut it into shards of --shard-size cases (default:
+            about four shards per worker, at least 500 cases each, so even a
+            5000-case file spreads across the pool and a slow shard does not hold up the end)
+    work    claim and score unfinished shards (--workers processes); run it on as many
+            machines as you like. --shard K [K ...] retries specific shards, ignoring locks
+    status  finished / claimed / failed / pending shards
+    merge   concatenate finished shards in order into the results file; line N is case N
+    run     plan + work + merge on this machine
+
+Usage:
+    python3 shard_results.py run [private_cases.json] [-o private_results.txt] [--workers N] [--shard-size N]
+    python3 shard_results.py plan [private_cases.json] --dir shards [--shard-size N] [--workers N]
+    python3 shard_results.py work --dir shards [--workers N] [--shard K ...]
+    python3 shard_results.py merge --dir shards [-o private_results.txt]
+"""
+
+import glob
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+from array import array
+
+from case_store import iter_case_offsets, iter_cases
+from generate_results import result_line
+import reimbursement_rules as _rules
+
+PLAN_FILE = 'plan.json'
+SHARDS_PER_WORKER = 4
+MIN_SHARD_SIZE = 500
+
+
+def _shard_path(work_dir, plan_id, index, suffix):
+    return os.path.join(work_dir, f"shard-{plan_id}-{index:05d}.{suffix}")
+
+
+def _plan_id(size, mtime_ns, shard_size, rules_fingerprint):
+    key = json.dumps([size, mtime_ns, shard_size, rules_fingerprint])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+def _remove_stale_shards(work_dir, plan_id):
+    """Delete shard files left by any other plan"""
+    for path in glob.glob(os.path.join(work_dir, 'shard-*')):
+        if not os.path.basename(path).startswith(f"shard-{plan_id}-"):
+            os.remove(path)
+
+
+def default_shard_size(count, workers=None):
+    """About SHARDS_PER_WORKER shards per worker, but none under MIN_SHARD_SIZE cases"""
+    workers = workers or os.cpu_count() or 1
+    return max(MIN_SHARD_SIZE, -(-count // (workers * SHARDS_PER_WORKER)))
+
+
+def plan(cases_path, work_dir, shard_size=None, workers=None):
+    """
+    Cut cases_path into shards of shard_size cases (default_shard_size for
+    workers processes when None); writes and returns the plan.
+    """
+    if shard_size is not None and shard_size < 1:
+        raise ValueError("shard size must be at least 1")
+    # Only the case boundaries are needed here; the workers decode the cases
+    end_offsets = array('q', iter_case_offsets(cases_path))
+    count = len(end_offsets)
+    shard_size = shard_size or default_shard_size(count, workers)
+    shards = []
+    for first in range(0, count, shard_size):
+        shards.append({'index': len(shards), 'first_case': first + 1,
+                       'start_offset': end_offsets[first - 1] if first else 0,
+                       'cases': min(shard_size, count - first)})
+
+    stat = os.stat(cases_path)
+    rules_fingerprint = _rules.rules_fingerprint(_rules.ACTIVE_RULES)
+    result = {'id': _plan_id(stat.st_size, stat.st_mtime_ns, shard_size, rules_fingerprint),
+              'source': os.path.abspath(cases_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+              'rules': rules_fingerprint, 'cases': count, 'shard_size': shard_size, 'shards': shards}
+    os.makedirs(work_dir, exist_ok=True)
+    tmp_path = os.path.join(work_dir, PLAN_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(tmp_path, os.path.join(work_dir, PLAN_FILE))
+    _remove_stale_shards(work_dir, result['id'])
+    return result
+
+
+def load_plan(work_dir, cases_path=None):
+    """The plan in work_dir; cases_path overrides the recorded source (e.g. another mount point)"""
+    with open(os.path.join(work_dir, PLAN_FILE)) as f:
+        result = json.load(f)
+    if cases_path:
+        result['source'] = os.path.abspath(cases_path)
+    if 'id' not in result:
+        raise ValueError(f"{work_dir} holds a plan from an older version; run plan again")
+    stat = os.stat(result['source'])
+    if (stat.st_size, stat.st_mtime_ns) != (result['size'], result['mtime_ns']):
+        raise ValueError(f"{result['source']} changed since it was planned; run plan again")
+    return result
+
+
+def check_rules(current):
+    """Refuse to score a plan made under a different rule set"""
+    if _rules.rules_fingerprint(_rules.ACTIVE_RULES) != current['rules']:
+        raise ValueError("the active rules differ from the ones the plan was made with; "
+                         "set the same REIMBURSEMENT_RULES or run plan again")
+
+
+def shard_state(work_dir, plan_id, index):
+    if os.path.exists(_shard_path(work_dir, plan_id, index, 'txt')):
+        return 'done'
+    if os.path.exists(_shard_path(work_dir, plan_id, index, 'lock')):
+        return 'claimed'
+    if os.path.exists(_shard_path(work_dir, plan_id, index, 'error')):
+        return 'failed'
+    return 'pending'
+
+
+def _claim(work_dir, plan_id, index, force=False):
+    """Create the shard's lock file; False if another worker holds it"""
+    lock_path = _shard_path(work_dir, plan_id, index, 'lock')
+    if force and os.path.exists(lock_path):
+        os.remove(lock_path)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'claimed_at': time.time()}, f)
+    return True
+
+
+def run_shard(source, plan_id, shard, work_dir):
+    """Score one shard into shard-<plan>-K.txt (via a temp file and rename); returns its case count"""
+    index = shard['index']
+    tmp_path = _shard_path(work_dir, plan_id, index, f'txt.{socket.gethostname()}.{os.getpid()}.tmp')
+    try:
+        written = 0
+        with open(tmp_path, 'w') as out:
+            lines = []
+            for case, _ in iter_cases(source, shard['start_offset']):
+                lines.append(result_line(case, shard['first_case'] + written) + '\n')
+                written += 1
+                if written == shard['cases']:
+                    break
+            if written != shard['cases']:
+                raise ValueError(f"expected {shard['cases']} cases, source ended after {written}")
+            out.writelines(lines)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, _shard_path(work_dir, plan_id, index, 'txt'))
+        if os.path.exists(_shard_path(work_dir, plan_id, index, 'error')):
+            os.remove(_shard_path(work_dir, plan_id, index, 'error'))
+        return written
+    except BaseException as error:
+        with open(_shard_path(work_dir, plan_id, index, 'error'), 'w') as f:
+            f.write(f"{socket.gethostname()} pid {os.getpid()}: {error!r}\n")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        # Release the claim either way: done shards are skipped, failed ones can be picked up again
+        lock_path = _shard_path(work_dir, plan_id, index, 'lock')
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+
+
+def _work_one(args):
+    source, plan_id, shard, work_dir, force = args
+    if shard_state(work_dir, plan_id, shard['index']) == 'done' and not force:
+        return shard['index'], 'skipped'
+    if not _claim(work_dir, plan_id, shard['index'], force):
+        return shard['index'], 'claimed elsewhere'
+    try:
+        run_shard(source, plan_id, shard, work_dir)
+    except Exception as error:
+        return shard['index'], f'failed: {error!r}'
+    return shard['index'], 'done'
+
+
+def work(work_dir, workers=None, only=None, cases_path=None):
+    """
+    Score every unfinished shard (or just the indexes in only, ignoring locks)
+    across a process pool; returns {index: outcome}.
+    """
+    current = load_plan(work_dir, cases_path)
+    check_rules(current)
+    shards = current['shards']
+    if only is not None:
+        unknown = set(only) - {shard['index'] for shard in shards}
+        if unknown:
+            raise ValueError(f"no such shard(s): {sorted(unknown)}")
+        shards = [shard for shard in shards if shard['index'] in set(only)]
+    tasks = [(current['source'], current['id'], shard, work_dir, only is not None) for shard in shards]
+    workers = workers or os.cpu_count() or 1
+
+    outcomes = {}
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_work_one, tasks)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_work_one, tasks)
+    try:
+        for index, outcome in results:
+            outcomes[index] = outcome
+            print(f"Shard {index}: {outcome}", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return outcomes
+
+
+def status(work_dir):
+    """{state: [shard indexes]}"""
+    current = load_plan(work_dir)
+    states = {}
+    for shard in current['shards']:
+        states.setdefault(shard_state(work_dir, current['id'], shard['index']), []).append(shard['index'])
+    return states
+
+
+def merge(work_dir, output_path='private_results.txt'):
+    """Concatenate the shards in order; refuses while any shard is unfinished or short"""
+    current = load_plan(work_dir)
+    missing = [shard['index'] for shard in current['shards']
+               if shard_state(work_dir, current['id'], shard['index']) != 'done']
+    if missing:
+        raise ValueError(f"shard(s) not finished: {missing}")
+
+    tmp_path = output_path + '.tmp'
+    total = 0
+    with open(tmp_path, 'w') as out:
+        for shard in current['shards']:
+            with open(_shard_path(work_dir, current['id'], shard['index'], 'txt')) as f:
+                lines = f.readlines()
+            if len(lines) != shard['cases']:
+                raise ValueError(f"shard {shard['index']} has {len(lines)} lines, expected {shard['cases']}")
+            out.writelines(lines)
+            total += len(lines)
+    os.replace(tmp_path, output_path)
+    return total
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sharded, multi-process private results generation")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, help_text, cases=False, directory=True, output=False, workers=False, shard_size=False):
+        command = commands.add_parser(name, help=help_text)
+        if cases:
+            command.add_argument('cases', nargs='?', default='private_cases.json')
+        if directory:
+            command.add_argument('--dir', default='shards', help="shared work directory")
+        if output:
+            command.add_argument('-o', '--output', default='private_results.txt')
+        if workers:
+            command.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+        if shard_size:
+            command.add_argument('--shard-size', type=int, default=None,
+                                 help=f"cases per shard (default: about {SHARDS_PER_WORKER} shards per worker, "
+                                      f"at least {MIN_SHARD_SIZE} cases)")
+        return command
+
+    add('plan', "cut the source into shards", cases=True, workers=True, shard_size=True)
+    work_parser = add('work', "score unfinished shards", workers=True)
+    work_parser.add_argument('--shard', type=int, nargs='+', help="retry just these shards, ignoring locks")
+    work_parser.add_argument('--cases', help="source path on this machine, if it differs from the plan")
+    add('status', "show shard states")
+    add('merge', "merge finished shards into one results file", output=True)
+    add('run', "plan, work and merge locally", cases=True, output=True, workers=True, shard_size=True)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'plan':
+            current = plan(args.cases, args.dir, args.shard_size, args.workers)
+            print(f"{current['cases']} cases in {len(current['shards'])} shards under {args.dir}", file=sys.stderr)
+        elif args.command == 'work':
+            outcomes = work(args.dir, args.workers, args.shard, args.cases)
+            if any(outcome.startswith('failed') for outcome in outcomes.values()):
+                sys.exit(1)
+        elif args.command == 'status':
+            for state, indexes in sorted(status(args.dir).items()):
+                print(f"{state}: {len(indexes)} {indexes if len(indexes) <= 20 else ''}".rstrip())
+        elif args.command == 'merge':
+            total = merge(args.dir, args.output)
+            print(f"✅ {total} results written to {args.output}", file=sys.stderr)
+        else:
+            plan(args.cases, args.dir, args.shard_size, args.workers)
+            outcomes = work(args.dir, args.workers)
+            failed = [index for index, outcome in outcomes.items() if outcome.startswith('failed')]
+            if failed:
+                print(f"❌ Shard(s) {failed} failed; retry with: python3 shard_results.py work --dir {args.dir} "
+                      f"--shard {' '.join(map(str, failed))}", file=sys.stderr)
+                sys.exit(1)
+            total = merge(args.dir, args.output)
+            print(f"✅ {total} results written to {args.output}", file=sys.stderr)
+    except (OSError, ValueError) as error:
+        print(f"❌ {error}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()